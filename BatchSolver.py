@@ -0,0 +1,71 @@
+from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from ParallelSolver import fork_context
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+
+# solves a stream of instances which share their variables and constraints and
+# only differ in their domains (sudokus of one size, or one map with some regions
+# already colored). the neighbors and compiled constraints are built once, and
+# each instance only loads its domain into the same ConstraintSatisfactionProblem.
+
+# what a worker process keeps between chunks
+_worker = {}
+
+class BatchSolver:
+        # domain: the initial domain. every instance's domain must be a subset of it.
+        # options go to ConstraintSatisfactionProblem, e.g. backend = "bitset"
+    def __init__(self, neighbors, domain, constraints, MRV = True, DH = False, LCV = True, AC3 = True, **options):
+        self.CSP = ConstraintSatisfactionProblem(neighbors, domain, constraints, MRV, DH, LCV, AC3, False, **options)
+
+        # converts one instance, as the caller gives it, into a domain. subclasses
+        # read boards, puzzle strings and so on.
+    def instance(self, item):
+        return item
+
+        # converts a solution back into the caller's terms
+    def answer(self, assignment):
+        return assignment
+
+        # the answer for one instance, None if it has no solution
+    def solve(self, item):
+        self.CSP.set_domain(self.instance(item))
+        assignment = self.CSP.get_assignment()
+
+        if assignment is None:
+            return None
+
+        return self.answer(assignment)
+
+        # yields the answer for every instance, in order, while reading them lazily.
+        # with workers, chunks of chunksize instances are solved in a process pool,
+        # with at most two chunks per worker read ahead.
+    def solve_all(self, items, workers = None, chunksize = 64):
+        items = iter(items)
+
+        if not workers:
+            for item in items:
+                yield self.solve(item)
+            return
+
+        executor = ProcessPoolExecutor(max_workers = workers, mp_context = fork_context(), initializer = init_worker, initargs = (self,))
+        in_flight = deque()
+
+        try:
+            for chunk in iter(lambda: list(itertools.islice(items, chunksize)), []):
+                in_flight.append(executor.submit(solve_chunk, chunk))
+
+                if len(in_flight) >= 2 * workers:
+                    yield from in_flight.popleft().result()
+
+            while in_flight:
+                yield from in_flight.popleft().result()
+        finally:
+            executor.shutdown(wait = True, cancel_futures = True)
+
+def init_worker(batch):
+    _worker["batch"] = batch
+
+def solve_chunk(chunk):
+    batch = _worker["batch"]
+    return [batch.solve(item) for item in chunk]
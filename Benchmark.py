@@ -0,0 +1,321 @@
+from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from Constraints import RectNoOverlap
+import MapColoringCSP
+import SudokuCSP
+import argparse
+import csv
+import gc
+import json
+import math
+import random
+import statistics
+import string
+import sys
+import time
+import tracemalloc
+
+# benchmarks every heuristic/inference configuration on seeded random instances:
+# planar maps, sudokus of a given size and density of givens, and piece sets for
+# circuit boards. the same seed always gives the same instance, so two runs (or a
+# run and a stored baseline) can be compared case by case. e.g.
+#   python Benchmark.py --suite quick --out base.json
+#   python Benchmark.py --suite quick --baseline base.json --threshold 0.25
+# fails (exit status 1) if any case got more than 25% slower, visited more nodes,
+# or took more memory or allocated blocks.
+
+# ---- instance generators. each returns (neighbors, domain, constraints)
+
+# a random planar map of regions regions: random points in the unit square, each
+# joined to its nearest points as long as the border crosses no other border, until
+# the map has degree * regions / 2 borders. returns a neighbor graph for
+# MapColoringCSP (region name -> set of region names)
+def random_map(regions, seed, degree = 3, nearest = 6):
+    rng = random.Random(seed)
+    points = [(rng.random(), rng.random()) for i in range(0, regions, 1)]
+
+    candidates = set()
+    for i in range(0, regions, 1):
+        closest = sorted(range(0, regions, 1), key = lambda j: distance(points[i], points[j]))
+        for j in closest[1:nearest + 1]:
+            candidates.add((min(i, j), max(i, j)))
+
+    borders = []
+    for i, j in sorted(candidates, key = lambda pair: (distance(points[pair[0]], points[pair[1]]), pair)):
+        if len(borders) >= degree * regions // 2:
+            break
+        if not any(crosses(points, (i, j), border) for border in borders):
+            borders.append((i, j))
+
+    graph = {"R" + str(i): set() for i in range(0, regions, 1)}
+    for i, j in borders:
+        graph["R" + str(i)].add("R" + str(j))
+        graph["R" + str(j)].add("R" + str(i))
+
+    return graph
+
+def distance(p, q):
+    return math.hypot(p[0] - q[0], p[1] - q[1])
+
+# whether two borders (pairs of point indices) cross. borders meeting at a point don't
+def crosses(points, a, b):
+    if a[0] in b or a[1] in b:
+        return False
+
+    p1, p2, q1, q2 = points[a[0]], points[a[1]], points[b[0]], points[b[1]]
+    return orientation(p1, p2, q1) * orientation(p1, p2, q2) < 0 and orientation(q1, q2, p1) * orientation(q1, q2, p2) < 0
+
+def orientation(p, q, r):
+    cross = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    return (cross > 0) - (cross < 0)
+
+def map_problem(regions, seed):
+    graph = random_map(regions, seed)
+    inverse_strmap = {value: key for key, value in MapColoringCSP.strmap(graph).items()}
+    colormap = MapColoringCSP.colormap()
+    neighbors = MapColoringCSP.neighborgraphToInt(graph, inverse_strmap)
+
+    return neighbors, MapColoringCSP.domainmap(neighbors, colormap), MapColoringCSP.constraintmap(neighbors, colormap)
+
+# an n x n sudoku board (n a perfect square) which always has a solution, though
+# not always a unique one: a solved board shuffled by rows within bands, bands,
+# columns within stacks, stacks and digits, with a fraction givens of cells kept
+def random_sudoku(n, givens, seed):
+    rng = random.Random(seed)
+    s = int(math.sqrt(n))
+
+    def shuffled_lines():
+        bands = rng.sample(range(0, s, 1), s)
+        return [band * s + line for band in bands for line in rng.sample(range(0, s, 1), s)]
+
+    rows = shuffled_lines()
+    columns = shuffled_lines()
+    digits = rng.sample(range(1, n + 1, 1), n)
+
+    board = [[digits[(s * (r % s) + r // s + c) % n] for c in columns] for r in rows]
+
+    cells = [(x, y) for x in range(0, n, 1) for y in range(0, n, 1)]
+    for x, y in rng.sample(cells, len(cells) - round(givens * len(cells))):
+        board[y][x] = 0
+
+    return board
+
+def sudoku_problem(n, givens, seed):
+    board = random_sudoku(n, givens, seed)
+    return SudokuCSP.genNeighbors(n), SudokuCSP.domainmap(board), SudokuCSP.constraintmap(n)
+
+# pieces for an n x m board which always fit: the board is cut (each time the
+# largest part, at a random line) into pieces parts, and parts are then dropped at
+# random until they cover at most fill of the board. returns a piecemap for
+# CircuitBoardCSP (char -> (width, height))
+def random_pieces(n, m, pieces, seed, fill = 0.8):
+    rng = random.Random(seed)
+    parts = [(n, m)]
+
+    while len(parts) < pieces:
+        parts.sort(key = lambda part: part[0] * part[1])
+        width, height = parts[-1]
+        if width == 1 and height == 1:
+            break
+        parts.pop()
+
+        if height == 1 or (width > 1 and rng.random() < width / (width + height)):
+            cut = rng.randint(1, width - 1)
+            parts += [(cut, height), (width - cut, height)]
+        else:
+            cut = rng.randint(1, height - 1)
+            parts += [(width, cut), (width, height - cut)]
+
+    rng.shuffle(parts)
+    while len(parts) > 2 and sum(w * h for w, h in parts) > fill * n * m:
+        parts.pop()
+
+    return {char: part for char, part in zip(string.ascii_letters, parts)}
+
+def circuit_problem(n, m, pieces, seed):
+    sizes = list(random_pieces(n, m, pieces, seed).values())
+
+    neighbors = { i : set(range(0, len(sizes), 1)) - { i } for i in range(0, len(sizes), 1) }
+    domain = { i : { (x, y) for x in range(0, n - sizes[i][0] + 1, 1) for y in range(0, m - sizes[i][1] + 1, 1) } for i in neighbors }
+    constraints = { (i, j) : RectNoOverlap(sizes[i], sizes[j]) for i in neighbors for j in neighbors if i < j }
+
+    return neighbors, domain, constraints
+
+# ---- what is run
+
+# configuration name -> arguments of ConstraintSatisfactionProblem
+CONFIGS = {
+    "backtracking" : dict(MRV = False, LCV = False, AC3 = False),
+    "mrv" : dict(MRV = True, LCV = False, AC3 = False),
+    "mrv-lcv-ac3" : dict(MRV = True, LCV = True, AC3 = True),
+    "mac" : dict(MRV = True, LCV = False, AC3 = True, MAC = True, AC3rm = True),
+    "mac-cbj" : dict(MRV = True, LCV = False, AC3 = True, MAC = True, AC3rm = True, CBJ = True),
+    "wdeg-mac" : dict(MRV = False, LCV = False, AC3 = True, MAC = True, AC3rm = True, WDEG = True),
+    "mac-bitset" : dict(MRV = True, LCV = False, AC3 = True, MAC = True, AC3rm = True, backend = "bitset"),
+}
+
+# suite name -> list of (instance name, builder, arguments)
+SUITES = {
+    "quick" : [
+        ("map-20-s1", map_problem, (20, 1)),
+        ("map-40-s1", map_problem, (40, 1)),
+        ("sudoku-4-0.3-s1", sudoku_problem, (4, 0.3, 1)),
+        ("sudoku-9-0.4-s1", sudoku_problem, (9, 0.4, 1)),
+        ("circuit-8x6-5-s1", circuit_problem, (8, 6, 5, 1)),
+        ("circuit-10x8-8-s1", circuit_problem, (10, 8, 8, 1)),
+    ],
+    "full" : [("map-%d-s%d" % (regions, seed), map_problem, (regions, seed)) for regions in (20, 50, 100) for seed in (1, 2, 3)] +
+             [("sudoku-9-%.1f-s%d" % (givens, seed), sudoku_problem, (9, givens, seed)) for givens in (0.3, 0.4, 0.5) for seed in (1, 2)] +
+             [("sudoku-16-0.5-s1", sudoku_problem, (16, 0.5, 1))] +
+             [("circuit-10x8-8-s%d" % seed, circuit_problem, (10, 8, 8, seed)) for seed in (1, 2, 3)] +
+             [("circuit-15x11-12-s1", circuit_problem, (15, 11, 12, 1))],
+}
+
+FIELDS = ["instance", "config", "status", "repeat", "setup_s", "search_s", "nodes", "propagations", "peak_kb", "blocks"]
+
+# times are only compared when both sides are the median of at least this many runs
+MIN_REPEAT = 3
+
+# one run: builds the problem and searches for at most max_nodes nodes. status is
+# "sat", "unsat", or "limit" if the search was cut off
+def run_once(builder, args, options, max_nodes):
+    t = time.perf_counter()
+    neighbors, domain, constraints = builder(*args)
+    csp = ConstraintSatisfactionProblem(neighbors, domain, constraints, print = False, **options)
+    setup = time.perf_counter() - t
+
+    t = time.perf_counter()
+    assignment = csp.get_assignment(max_nodes)
+    search = time.perf_counter() - t
+
+    status = "limit" if not csp.finished else ("sat" if assignment is not None else "unsat")
+    return csp, status, setup, search
+
+# the median of repeat runs for the times, then one more run under tracemalloc
+# for the peak memory and the memory blocks (net of those freed) it allocated
+def run_case(name, builder, args, config, repeat, max_nodes):
+    options = CONFIGS[config]
+    setups = []
+    searches = []
+
+    for i in range(0, repeat, 1):
+        csp, status, setup, search = run_once(builder, args, options, max_nodes)
+        setups.append(setup)
+        searches.append(search)
+    del csp
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    csp, status, setup, search = run_once(builder, args, options, max_nodes)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks
+
+    return {
+        "instance" : name,
+        "config" : config,
+        "status" : status,
+        "repeat" : repeat,
+        "setup_s" : round(statistics.median(setups), 6),
+        "search_s" : round(statistics.median(searches), 6),
+        "nodes" : csp.nodes_visited,
+        "propagations" : csp.propagations,
+        "peak_kb" : round(peak / 1024, 1),
+        "blocks" : blocks,
+    }
+
+def run_suite(suite, configs, repeat = 3, max_nodes = 20000, log = None):
+    results = []
+
+    for name, builder, args in SUITES[suite]:
+        for config in configs:
+            result = run_case(name, builder, args, config, repeat, max_nodes)
+            results.append(result)
+
+            if log is not None:
+                log.write("{:22s} {:13s} {:6s} {:9.4f}s {:8d} nodes {:9d} props {:9.1f} KB\n".format(name, config, result["status"], result["setup_s"] + result["search_s"], result["nodes"], result["propagations"], result["peak_kb"]))
+
+    return results
+
+# the cases which got worse than baseline by more than threshold (a fraction): in
+# time, nodes, memory, allocated blocks, or by no longer finishing. times and blocks
+# also have to grow by more than min_seconds and min_blocks, below which they are
+# noise, and times are only compared between medians of MIN_REPEAT runs or more.
+# returns a list of (instance, config, what, old, new)
+def regressions(results, baseline, threshold, min_seconds = 0.02, min_blocks = 100):
+    old = {(result["instance"], result["config"]): result for result in baseline}
+    found = []
+
+    for result in results:
+        before = old.get((result["instance"], result["config"]))
+        if before is None:
+            continue
+
+        if before["status"] != "limit" and result["status"] == "limit":
+            found.append((result["instance"], result["config"], "status", before["status"], result["status"]))
+
+        timed = min(result.get("repeat", 1), before.get("repeat", 1)) >= MIN_REPEAT
+        for field, floor in (("setup_s", min_seconds), ("search_s", min_seconds), ("nodes", 0), ("propagations", 0), ("peak_kb", 0), ("blocks", min_blocks)):
+            if field.endswith("_s") and not timed:
+                continue
+            # blocks are net of those freed, so they may be negative
+            if result[field] - before[field] > max(abs(before[field]) * threshold, floor):
+                found.append((result["instance"], result["config"], field, before[field], result[field]))
+
+    return found
+
+def write_json(path, suite, results):
+    with open(path, "w") as file:
+        json.dump({"suite" : suite, "python" : sys.version.split()[0], "results" : results}, file, indent = 1)
+
+def write_csv(path, results):
+    with open(path, "w", newline = "") as file:
+        writer = csv.DictWriter(file, fieldnames = FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmarks the CSP solver on seeded random instances.")
+    parser.add_argument("--suite", choices = sorted(SUITES), default = "quick")
+    parser.add_argument("--configs", default = ",".join(CONFIGS), help = "comma separated, from: " + ", ".join(CONFIGS))
+    parser.add_argument("--repeat", type = int, default = MIN_REPEAT, help = "runs per case, the median counts (times are only compared with at least " + str(MIN_REPEAT) + ")")
+    parser.add_argument("--max-nodes", type = int, default = 20000, help = "node budget per run")
+    parser.add_argument("--out", help = "JSON file for the results")
+    parser.add_argument("--csv", help = "CSV file for the results")
+    parser.add_argument("--baseline", help = "JSON file of earlier results to compare against")
+    parser.add_argument("--threshold", type = float, default = 0.25, help = "allowed slowdown, as a fraction")
+    parser.add_argument("--min-seconds", type = float, default = 0.02, help = "smaller slowdowns are noise")
+    parser.add_argument("--min-blocks", type = int, default = 100, help = "smaller growths in allocated blocks are noise")
+    options = parser.parse_args(argv)
+
+    configs = options.configs.split(",")
+    for config in configs:
+        if config not in CONFIGS:
+            parser.error("unknown configuration " + config)
+
+    results = run_suite(options.suite, configs, options.repeat, options.max_nodes, sys.stdout)
+
+    if options.out:
+        write_json(options.out, options.suite, results)
+    if options.csv:
+        write_csv(options.csv, results)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)["results"]
+
+        if options.repeat < MIN_REPEAT:
+            print("times not compared: fewer than {:d} runs per case".format(MIN_REPEAT))
+
+        found = regressions(results, baseline, options.threshold, options.min_seconds, options.min_blocks)
+        for instance, config, field, before, after in found:
+            print("REGRESSION {:s} {:s} {:s}: {} -> {}".format(instance, config, field, before, after))
+
+        if found:
+            return 1
+        print("no regressions against " + options.baseline)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
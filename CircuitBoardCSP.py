@@ -1,111 +1,56 @@
 # Maxwell Carmichael, 10/11/2020
 
 from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from Constraints import RectNoOverlap, OrderedRectNoOverlap, RectTables, CacheBudget
+from math import factorial
 
 class CircuitBoardCSP:
     # piecemap: {char: (width, height))
-    def __init__(self, name, piecemap, n, m, MRV = True, DH = False, LCV = True, AC3 = True, print = False):
+    # options go to ConstraintSatisfactionProblem, e.g. backend = "bitset"
+    # symmetry: pieces of the same size are placed in increasing order of position,
+    # so only one of their permutations is searched
+    # board_symmetry: also keep one piece in the bottom-left of the board, which
+    # breaks its reflections (and rotations, for a square board of square pieces)
+    # max_table_bytes: a cap on the memory the constraint tables and the encodings
+    # cached from them keep (see CacheBudget), past which new entries are computed
+    # every time instead. domains and the search's own state are not included
+    def __init__(self, name, piecemap, n, m, MRV = True, DH = False, LCV = True, AC3 = True, print = False, symmetry = True, board_symmetry = False, max_table_bytes = None, **options):
         self.name = name
 
         self.n = n
         self.m = m
 
         self.piecemap = piecemap # char -> (w,h)
-        self.charmap = self.__charmap() # int -> char
+        self.charmap = charmap(piecemap) # int -> char
         self.inverse_charmap = {value: key for key, value in self.charmap.items()} # char -> int
 
         # self.colormap = self.__colormap() # int -> str
-        self.neighbors = self.__genCompleteGraph()
+        self.neighbors = genCompleteGraph(self.charmap)
 
         # construct domain
-        domain = self.__domainmap(n, m)
-        # construct constraints
-        constraints = self.__constraintmap(domain)
+        domain = domainmap(self.neighbors, self.charmap, piecemap, n, m)
+
+        # symmetry breaking: groups of interchangeable pieces, and the board
+        # symmetries broken through one piece's domain
+        self.groups = interchangeable(self.charmap, piecemap) if symmetry else []
+        values = sum(len(values) for values in domain.values())
+        if board_symmetry:
+            self.symmetries = breakBoardSymmetry(domain, self.charmap, piecemap, n, m, self.groups)
+        else:
+            self.symmetries = []
+        self.values_pruned = values - sum(len(values) for values in domain.values())
+
+        # construct constraints, whose tables are filled in as the search needs them
+        self.budget = CacheBudget(max_table_bytes)
+        self.tables = RectTables(n, m, self.budget)
+        constraints = constraintmap(self.neighbors, self.charmap, piecemap, self.groups, self.tables)
 
-        self.CSP = ConstraintSatisfactionProblem(self.neighbors, domain, constraints, MRV, DH, LCV, AC3, print)
+        self.CSP = ConstraintSatisfactionProblem(self.neighbors, domain, constraints, MRV, DH, LCV, AC3, print, cache_budget = self.budget, **options)
         self.solution = self.__find_solution()
 
     def __find_solution(self):
         return self.CSP.get_assignment()
 
-    def __charmap(self):
-        charset = list(self.piecemap.keys()) # list for replicability
-        # random.shuffle(strset)
-        # print(strset)
-
-        charmap = {key: charset.pop() for key in range(0, len(charset), 1)}
-
-        # print(charmap)
-        return charmap
-
-        # everything is a neighbor to everything
-    def __genCompleteGraph(self):
-        completeGraph = {}
-
-        pieces = self.charmap.keys()
-
-        for piece in self.charmap:
-            neighbors = set(pieces)
-            neighbors.remove(piece)
-            completeGraph[piece] = neighbors
-
-        # print(completeGraph)
-        return completeGraph
-
-    def __domainmap(self, n, m):
-        domain = {}
-
-        for variable in self.neighbors:
-            possibleCoordinates = set()
-
-            length = self.piecemap[self.charmap[variable]][0]
-            height = self.piecemap[self.charmap[variable]][1]
-
-            # only possible locations are those which fit in the n x m space
-            for x in range(0, n - length + 1, 1):
-                for y in range(0, m - height + 1, 1):
-                    possibleCoordinates.add((x,y))
-
-            domain[variable] = possibleCoordinates
-
-        # print(domain)
-        return domain
-
-    def __constraintmap(self, domain):
-        # idea: we set a piece at coordinate (x,y). That means no other piece can be between (x,y) and (x+length,y+height). so, (0,0)
-        constraints = {}
-
-        # find out constraints for (i,j) pair in complete graph
-        for vari in range(0, len(self.neighbors) - 1, 1):
-            for varj in range(vari + 1, len(self.neighbors), 1):
-                var_pair = (vari,varj)
-                constraints[var_pair] = self.__genCombos(domain, vari, varj)
-
-        # print(constraints)
-
-        return constraints
-
-    def __genCombos(self, domain, vari, varj):
-        possibleCombos = set()
-
-        lengthi = self.piecemap[self.charmap[vari]][0]
-        heighti = self.piecemap[self.charmap[vari]][1]
-        lengthj = self.piecemap[self.charmap[varj]][0]
-        heightj = self.piecemap[self.charmap[varj]][1]
-
-        # loop over the domain of vari and domain of varj and if they do not
-        # overlap, add them to possible combos
-        for coordi in domain[vari]:
-            for coordj in domain[varj]:
-                # vari on other side of varj
-                if coordi[0] + lengthi - 1 < coordj[0] or coordj[0] + lengthj - 1 < coordi[0]:
-                    possibleCombos.add((coordi,coordj))
-                # vari on top/below varj
-                elif coordi[1] + heighti - 1 < coordj[1] or coordj[1] + heightj - 1 < coordi[1]:
-                    possibleCombos.add((coordi,coordj))
-
-        return possibleCombos
-
     def __str__(self):
         string = "----\n"
         string += "Circuit Board CSP Problem: {:s}\n"
@@ -122,6 +67,34 @@ class CircuitBoardCSP:
 
             string = string.format(self.name, str(self.CSP.MRV_FLAG), str(self.CSP.DH_FLAG), str(self.CSP.LCV_FLAG), str(self.CSP.AC3_FLAG), self.CSP.nodes_visited)
 
+        if self.CSP.CBJ_FLAG:
+            string += "Backjumps: {:d}. Nogoods learned: {:d}. Nogood prunings: {:d}\n".format(self.CSP.backjumps, self.CSP.nogoods_learned, self.CSP.nogood_prunings)
+
+        if self.groups or self.symmetries:
+            string += self.__symmetryToStr()
+
+        string += str(self.tables)
+
+        return string
+
+        # the memory taken by the constraint tables and cached encodings, in total
+        # and by cache (see CacheBudget.footprint), and how many tables and entries
+    def footprint(self):
+        return self.tables.footprint()
+
+        # at most how many solutions each one left stands for: k! for every k
+        # interchangeable pieces, times 2 for each board symmetry broken (fewer when
+        # a solution is its own reflection)
+    def symmetry_factor(self):
+        factor = 2 ** len(self.symmetries)
+        for group in self.groups:
+            factor *= factorial(len(group))
+        return factor
+
+    def __symmetryToStr(self):
+        groups = ["".join(self.charmap[variable] for variable in group) for group in self.groups]
+        string = "Symmetry breaking: interchangeable pieces {:s}. Board symmetries: {:s}\n".format(", ".join(groups) or "none", ", ".join(self.symmetries) or "none")
+        string += "Values pruned: {:d} up front, {:d} by ordering interchangeable pieces. Solutions per one searched: at most {:d}\n".format(self.values_pruned, self.CSP.pruned.get("symmetry breaking", 0), self.symmetry_factor())
         return string
 
         # returns a dictionary
@@ -160,6 +133,128 @@ class CircuitBoardCSP:
         return coord[0] + (self.m - coord[1] - 1) * self.n
 
 
+# the structure of a board only depends on its pieces and size, so it is built by
+# these functions, which the solver service shares
+
+def charmap(piecemap):
+    charset = list(piecemap.keys()) # list for replicability
+    # random.shuffle(strset)
+    # print(strset)
+
+    charmap = {key: charset.pop() for key in range(0, len(charset), 1)}
+
+    # print(charmap)
+    return charmap
+
+# everything is a neighbor to everything
+def genCompleteGraph(charmap):
+    completeGraph = {}
+
+    pieces = charmap.keys()
+
+    for piece in charmap:
+        neighbors = set(pieces)
+        neighbors.remove(piece)
+        completeGraph[piece] = neighbors
+
+    # print(completeGraph)
+    return completeGraph
+
+def domainmap(neighbors, charmap, piecemap, n, m):
+    domain = {}
+
+    for variable in neighbors:
+        possibleCoordinates = set()
+
+        length = piecemap[charmap[variable]][0]
+        height = piecemap[charmap[variable]][1]
+
+        # only possible locations are those which fit in the n x m space
+        for x in range(0, n - length + 1, 1):
+            for y in range(0, m - height + 1, 1):
+                possibleCoordinates.add((x,y))
+
+        domain[variable] = possibleCoordinates
+
+    # print(domain)
+    return domain
+
+# pieces of the same size can swap places in any solution. returns the variables
+# of each such size (in increasing order) which has more than one piece
+def interchangeable(charmap, piecemap):
+    sizes = {}
+
+    for variable in sorted(charmap):
+        sizes.setdefault(piecemap[charmap[variable]], []).append(variable)
+
+    return [group for group in sizes.values() if len(group) > 1]
+
+# reflecting a solution across the middle of the board gives another solution, and
+# so does transposing it, if the board and every piece are square. these are broken
+# by keeping one piece (the largest whose size no other piece has, so that ordering
+# interchangeable pieces cannot move it) on the bottom-left side of each. prunes
+# its domain in place and returns the symmetries broken
+def breakBoardSymmetry(domain, charmap, piecemap, n, m, groups):
+    grouped = {variable for group in groups for variable in group}
+    sizes = [piecemap[charmap[variable]] for variable in charmap]
+    unique = [variable for variable in charmap if variable not in grouped and sizes.count(piecemap[charmap[variable]]) == 1]
+
+    if not unique:
+        return []
+
+    variable = max(unique, key = lambda v: (piecemap[charmap[v]][0] * piecemap[charmap[v]][1], -v))
+    length, height = piecemap[charmap[variable]]
+    symmetries = []
+
+    # a reflection maps x to n - length - x, so the piece stays at or left of the middle
+    if length < n:
+        domain[variable] = {(x,y) for (x,y) in domain[variable] if 2 * x <= n - length}
+        symmetries.append("horizontal reflection")
+
+    if height < m:
+        domain[variable] = {(x,y) for (x,y) in domain[variable] if 2 * y <= m - height}
+        symmetries.append("vertical reflection")
+
+    # with both reflections, this also breaks the rotations
+    if n == m and length < n and all(width == size for width, size in sizes):
+        domain[variable] = {(x,y) for (x,y) in domain[variable] if x <= y}
+        symmetries.append("diagonal reflection")
+
+    return symmetries
+
+# ordered: groups of interchangeable pieces (see interchangeable), whose pairs are
+# constrained to be in increasing order of position. tables: a RectTables for the
+# board, through which pieces look up their conflicts. pairs of pieces with the
+# same sizes share one constraint
+def constraintmap(neighbors, charmap, piecemap, ordered = (), tables = None):
+    # idea: we set a piece at coordinate (x,y). That means no other piece can be between (x,y) and (x+length,y+height). so, (0,0)
+    constraints = {}
+
+    group_of = {variable: index for index, group in enumerate(ordered) for variable in group}
+    shared = {} # (size of i, size of j, ordered) -> constraint
+
+    # find out constraints for (i,j) pair in complete graph. the overlap test is
+    # evaluated directly, rather than enumerating every non-overlapping pair
+    for vari in range(0, len(neighbors) - 1, 1):
+        for varj in range(vari + 1, len(neighbors), 1):
+            var_pair = (vari,varj)
+            isize = piecemap[charmap[vari]]
+            jsize = piecemap[charmap[varj]]
+            ordered_pair = vari in group_of and group_of.get(varj) == group_of[vari]
+
+            key = (isize, jsize, ordered_pair)
+            if key not in shared:
+                if ordered_pair:
+                    shared[key] = OrderedRectNoOverlap(isize, tables)
+                else:
+                    shared[key] = RectNoOverlap(isize, jsize, tables)
+
+            constraints[var_pair] = shared[key]
+
+    # print(constraints)
+
+    return constraints
+
 # 3x3, with a 1x1 piece and 2x2 piece
 def test1():
     piecemap = { 'a' : (1,1), 'b' : (2,2)}
@@ -204,6 +299,50 @@ def test4():
     print("solving...")
     print(p)
 
+# regression: the degree heuristic alone (ties to the smallest domain, then the
+# lowest variable) must not thrash on a complete graph, where every variable ties.
+# the 15x11 board of test4, numbered as CircuitBoardCSP does, without symmetry breaking
+def test5():
+    piecemap = { 'a' : (3,6), 'b' : (1,5), 'd' : (3,11), 'e' : (2,5), 'h' : (3,5), 'i' : (1,10), 'j' : (6,6), 'k' : (2,4), 'l' : (1,1), 'm' : (5,4), 'n' : (5,1), 'o' : (1,1), 'p' : (3,1)}
+    n = 15
+    m = 11
+    sizes = list(reversed(list(piecemap.values())))
+
+    neighbors = { i : set(range(0, len(sizes), 1)) - { i } for i in range(0, len(sizes), 1) }
+    domain = { i : { (x, y) for x in range(0, n - sizes[i][0] + 1, 1) for y in range(0, m - sizes[i][1] + 1, 1) } for i in neighbors }
+    constraints = { (i, j) : RectNoOverlap(sizes[i], sizes[j]) for i in neighbors for j in neighbors if i < j }
+
+    csp = ConstraintSatisfactionProblem(neighbors, domain, constraints, False, True, False, True, False)
+    assignment = csp.get_assignment(200)
+
+    assert assignment is not None and csp.is_valid(assignment), "DH only: no solution after {:d} nodes".format(csp.nodes_visited)
+    print("DH only: 15x11 solved in {:d} nodes".format(csp.nodes_visited))
+
+# symmetry breaking keeps exactly one of the k! orders of k interchangeable pieces,
+# and at least one solution of each set of reflections, on small boards
+def test6():
+    boards = [({ 'a' : (2,2), 'b' : (1,1), 'c' : (1,1), 'd' : (1,1), 'e' : (2,1) }, 4, 3),
+              ({ 'a' : (2,2), 'b' : (1,1), 'c' : (1,1), 'd' : (1,1), 'e' : (1,1) }, 3, 3),
+              ({ 'a' : (3,1), 'b' : (3,1), 'c' : (1,2), 'd' : (2,2) }, 4, 4),
+              ({ 'a' : (2,2), 'b' : (2,2), 'c' : (2,2) }, 4, 4)]
+
+    for piecemap, n, m in boards:
+        full = CircuitBoardCSP("full", piecemap, n, m, symmetry = False).CSP.count_solutions()
+        ordered = CircuitBoardCSP("ordered", piecemap, n, m)
+        reflected = CircuitBoardCSP("reflected", piecemap, n, m, board_symmetry = True)
+
+        orders = ordered.symmetry_factor()
+        assert ordered.CSP.count_solutions() * orders == full, "{:d}x{:d}: {:d} solutions, {:d} ordered".format(n, m, full, ordered.CSP.count_solutions())
+
+        count = reflected.CSP.count_solutions()
+        assert (count > 0) == (full > 0) and count * reflected.symmetry_factor() >= full, "{:d}x{:d}: {:d} solutions, {:d} with reflections broken".format(n, m, full, count)
+        assert reflected.solution is None or reflected.CSP.is_valid(reflected.solution)
+
+        print("{:d}x{:d}: {:d} solutions, {:d} ordered, {:d} with reflections broken".format(n, m, full, full // orders, count))
+
 # test2()
 # test3()
-test4()
+if __name__ == "__main__":
+    test4()
+    test5()
+    test6()
@@ -0,0 +1,107 @@
+from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from Components import components, subproblem
+from ParallelSolver import fork_context
+from concurrent.futures import ProcessPoolExecutor
+
+# solves a problem whose constraint graph falls apart into connected components
+# (tasmania, islands, regions with no neighbors) one component at a time. each
+# component gets its own ConstraintSatisfactionProblem, so a dead end in one never
+# makes the search redo the others, and a component without a solution is found
+# (and reported) on its own. the components' solutions are merged into one.
+
+# what a worker process keeps between components
+_worker = {}
+
+class ComponentSolver:
+        # options go to ConstraintSatisfactionProblem, e.g. backend = "bitset"
+    def __init__(self, neighbors, domain, constraints, MRV = True, DH = False, LCV = True, AC3 = True, **options):
+        self.size = len(neighbors)
+        self.parts = components(neighbors, constraints) # list of sorted lists of variables
+        self.problems = [ConstraintSatisfactionProblem(*subproblem(variables, neighbors, domain, constraints), MRV, DH, LCV, AC3, False, **options) for variables in self.parts]
+
+        # the flags every component is searched with, as on ConstraintSatisfactionProblem
+        self.MRV_FLAG = MRV
+        self.DH_FLAG = DH
+        self.LCV_FLAG = LCV
+        self.AC3_FLAG = AC3
+        self.CBJ_FLAG = options.get("CBJ", False)
+
+        # filled in by get_assignment, the counters summed over the components
+        self.results = [] # each component's assignment (over its own variables 0, 1, ...), or None
+        self.unsatisfiable = [] # the components (lists of variables) with no solution
+        self.nodes_visited = 0
+        self.backjumps = 0
+        self.nogoods_learned = 0
+        self.nogood_prunings = 0
+
+        # the merged assignment (list indexed by variable), or None if any component
+        # has no solution. every component is searched either way, so that all the
+        # unsatisfiable ones are reported. with workers, components are searched in
+        # a process pool, largest first.
+    def get_assignment(self, workers = None):
+        if workers and len(self.problems) > 1:
+            executor = ProcessPoolExecutor(max_workers = workers, mp_context = fork_context(), initializer = init_worker, initargs = (self,))
+            order = sorted(range(len(self.problems)), key = lambda i: -len(self.parts[i]))
+
+            try:
+                futures = {i: executor.submit(solve_part, i) for i in order}
+                solved = [futures[i].result() for i in range(len(self.problems))]
+            finally:
+                executor.shutdown(wait = True, cancel_futures = True)
+        else:
+            solved = [solve_problem(problem) for problem in self.problems]
+
+        self.results = [assignment for assignment, counters in solved]
+        self.nodes_visited = sum(counters[0] for assignment, counters in solved)
+        self.backjumps = sum(counters[1] for assignment, counters in solved)
+        self.nogoods_learned = sum(counters[2] for assignment, counters in solved)
+        self.nogood_prunings = sum(counters[3] for assignment, counters in solved)
+        self.unsatisfiable = [variables for variables, assignment in zip(self.parts, self.results) if assignment is None]
+
+        if self.unsatisfiable:
+            return None
+
+        merged = [None] * self.size
+        for variables, assignment in zip(self.parts, self.results):
+            for i, variable in enumerate(variables):
+                merged[variable] = assignment[i]
+
+        return merged
+
+# the assignment, and the counters of the search (as they are summed in ComponentSolver)
+def solve_problem(problem):
+    assignment = problem.get_assignment()
+    counters = (problem.nodes_visited, problem.backjumps, problem.nogoods_learned, problem.nogood_prunings)
+    return (None if assignment is None else list(assignment)), counters
+
+def init_worker(solver):
+    _worker["solver"] = solver
+
+def solve_part(i):
+    return solve_problem(_worker["solver"].problems[i])
+
+# australia, with an unsatisfiable triangle (only two colors) off the coast
+def test1():
+    neighbors = { 0 : {1, 2}, 1 : {0, 2, 3}, 2 : {0, 1, 3, 4, 5}, 3 : {1, 2, 4},
+                    4 : {2, 3, 5}, 5 : {2, 4}, 6 : set(), 7 : {8, 9}, 8 : {7, 9}, 9 : {7, 8}}
+    domain = { variable : {0, 1, 2} for variable in neighbors }
+    for variable in (7, 8, 9):
+        domain[variable] = {0, 1}
+    colorsneq = { (0,1), (0,2), (1,0), (1,2), (2,0), (2,1) }
+    constraints = { (i, j) : set(colorsneq) for i in neighbors for j in neighbors[i] if i < j }
+
+    solver = ComponentSolver(neighbors, domain, constraints)
+    print(solver.parts)
+    print(solver.get_assignment())
+    print(solver.unsatisfiable)
+
+    # without the triangle
+    del constraints[(8,9)]
+    neighbors[8].remove(9)
+    neighbors[9].remove(8)
+    solver = ComponentSolver(neighbors, domain, constraints)
+    print(solver.get_assignment(workers = 2))
+    print(solver.results)
+
+if __name__ == "__main__":
+    test1()
@@ -0,0 +1,49 @@
+# a problem whose constraint graph falls apart into several connected components
+# (an island on a map, or a region with no neighbors at all) is really several
+# independent problems. these functions find the components and cut a problem
+# down to one of them, so that each can be searched (or counted) on its own.
+
+# the connected components of the constraint graph, each a sorted list of
+# variables, in the order of their lowest variable
+def components(neighbors, constraints):
+    adjacent = {variable: set(neighbors[variable]) for variable in neighbors}
+
+    # an n-ary constraint ties its whole scope together
+    for scope in constraints:
+        for variable in scope:
+            adjacent[variable].update(scope)
+
+    found = []
+    seen = set()
+
+    for start in sorted(adjacent):
+        if start in seen:
+            continue
+
+        seen.add(start)
+        component = [start]
+        frontier = [start]
+
+        while frontier:
+            variable = frontier.pop()
+            for other in adjacent[variable]:
+                if other not in seen:
+                    seen.add(other)
+                    component.append(other)
+                    frontier.append(other)
+
+        found.append(sorted(component))
+
+    return found
+
+# the part of a problem over variables (one or more whole components), with the
+# variables renumbered 0, 1, ... in the order given. given sorted variables, a
+# constrained pair (i,j) with i<j keeps i<j. returns neighbors, domain, constraints
+def subproblem(variables, neighbors, domain, constraints):
+    number = {variable: i for i, variable in enumerate(variables)}
+
+    sub_neighbors = {number[variable]: {number[other] for other in neighbors[variable] if other in number} for variable in variables}
+    sub_domain = {number[variable]: set(domain[variable]) for variable in variables}
+    sub_constraints = {tuple(number[variable] for variable in scope): constraint for scope, constraint in constraints.items() if scope[0] in number}
+
+    return sub_neighbors, sub_domain, sub_constraints
@@ -1,321 +1,1208 @@
 # Maxwell Carmichael, 10/11/2020
 
 from collections import deque
-import copy
+from DomainStore import DomainStore, BitsetDomainStore, NumpyDomainStore
+from Constraints import TableSupports, ConflictSupports, PredicateSupports, MatrixSupports, StackedSupports
+from Nogoods import NogoodStore
+from VariableQueue import VariableQueue
+from Components import components, subproblem
+from Stats import SearchStats, SearchResult, SAT, UNSAT, TIMEOUT, CANCELLED
+import random
 import time
 
-# ASSUMPTION: constraints are binary and nothing more, and all variables need assignment.
+# the luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ... (i from 1)
+def luby(i):
+    while True:
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+
+        i -= (1 << (k - 1)) - 1
+
+# ways of representing the domain, chosen by the backend argument
+BACKENDS = { "set" : DomainStore, "bitset" : BitsetDomainStore, "numpy" : NumpyDomainStore }
+
+# ASSUMPTION: all variables need assignment.
 class ConstraintSatisfactionProblem:
         # variables: set. domain: map (value -> set). constraints: map (pair -> possible variables)
-    def __init__(self, neighbors, domain, constraints, MRV = True, DH = False, LCV = True, AC3 = True, print = True):
+        # a constraint may also be a built-in one from Constraints.py, or any
+        # callable predicate(ivalue, jvalue). a longer tuple of variables maps to an
+        # n-ary constraint, such as AllDifferent
+        # backend: "set" keeps each domain as a python set, "bitset" as an int bitmask,
+        # "numpy" (which needs numpy) the whole domain as one boolean matrix
+        # MAC: with AC3, run full AC-3 once at the root, then at each node only
+        # propagate from the variables which that node's assignment changed
+        # AC3rm: with AC3, revise with residual supports (AC-3rm) instead of
+        # searching for a support from scratch every time
+        # seed: if given, MRV ties are broken at random from this seed
+        # CBJ: conflict-directed backjumping. a dead end jumps straight back to the
+        # deepest variable which caused it, and is learned as a nogood (at most
+        # max_nogood_size pairs, and the max_nogoods most recently used are kept)
+        # restarts: "luby" or "geometric". the search starts over after restart_base
+        # nodes times luby(run), or restart_base * restart_factor^run, with MRV ties
+        # broken at random (from seed, or 0). with keep_learned, what was learned
+        # carries over: nogoods, the last value each variable had (tried first
+        # again) and how often each variable hit a dead end (ties go to the worst)
+        # WDEG: dom/wdeg ordering instead of MRV. every constraint has a weight, one
+        # more each time it wipes out a domain, and the variable with the smallest
+        # domain size / (weight of its constraints on unassigned variables) goes first
+        # ACTIVITY: the variable with the smallest domain size / activity goes first,
+        # where a variable's activity grows whenever propagation prunes it, and
+        # decays by activity_decay with every assignment
+        # profile: count the values each kind of propagator prunes (see stats). a
+        # constraint with a kind attribute (such as the symmetry breaking
+        # OrderedRectNoOverlap) has what it prunes counted under that kind, always
+        # on_assign(variable, value), on_backtrack(variable) and on_wipeout(scope)
+        # are called when a value is tried, when every value of a variable has
+        # failed, and when the constraint on scope empties a domain. they may also
+        # be set as attributes later. unlike print, they cost nothing when None
+        # cache_budget: a CacheBudget (see Constraints.py) which the encodings that
+        # built-in and predicate constraints cache for LCV are charged to
+    def __init__(self, neighbors, domain, constraints, MRV = True, DH = False, LCV = True, AC3 = True, print = True, backend = "set", MAC = False, AC3rm = False, seed = None, CBJ = False, max_nogoods = 1000, max_nogood_size = 10,
+                 restarts = None, restart_base = 100, restart_factor = 1.5, keep_learned = True, WDEG = False, ACTIVITY = False, activity_decay = 0.95,
+                 profile = False, on_assign = None, on_backtrack = None, on_wipeout = None, cache_budget = None):
+        t = time.perf_counter()
         self.neighbors = neighbors
-        self.domain = domain
-        self.constraints = constraints # (i,j) -> set of possible combos. i<j
+        self.backend = backend
+        self.domain = BACKENDS[backend](domain) # modified in place, undone through its trail
+        self.constraints = constraints # (i,j) -> set of possible combos (or constraint). i<j
+        self.cache_budget = cache_budget
+        self.supports = self.__compile_constraints(domain) # (x,y) -> propagator for that arc, see Constraints.py
+        self.arcs = {variable: [] for variable in neighbors} # x -> every y with a constraint arc (x,y)
+        for (x, y) in self.supports:
+            self.arcs[x].append(y)
+
+        # numpy: x -> forward checking of all of x's arcs at once
+        self.forwards = {}
+        if backend == "numpy":
+            for x in self.arcs:
+                if self.arcs[x]:
+                    self.forwards[x] = StackedSupports(self.domain, [(y, self.supports[(x, y)]) for y in self.arcs[x]])
+
+        # n-ary constraints: list of (scope, constraint), and variable -> their indices
+        self.globals = [(scope, constraint) for scope, constraint in constraints.items() if len(scope) > 2]
+        self.globals_of = {variable: [] for variable in neighbors}
+        for index, (scope, constraint) in enumerate(self.globals):
+            for variable in scope:
+                self.globals_of[variable].append(index)
+
+        # for LCV: variable -> (n-ary constraint, the other variables of its scope),
+        # where a variable sharing several n-ary constraints only counts in the first
+        self.peers = {variable: [] for variable in neighbors}
+        for variable in neighbors:
+            seen = { variable }
+            for index in self.globals_of[variable]:
+                scope, constraint = self.globals[index]
+                others = [other for other in scope if other not in seen]
+                seen.update(others)
+                self.peers[variable].append((constraint, others))
 
         self.MRV_FLAG = MRV # minimum remaining values (when choosing variable)
         self.DH_FLAG = DH
         self.LCV_FLAG = LCV # least constraining value (when choosing value). Very useful in stopping recursion when a var has no more vals left to assign.
         self.AC3_FLAG = AC3 # inference
+        self.MAC_FLAG = MAC # incremental inference (maintaining arc consistency)
+        self.AC3rm_FLAG = AC3rm # residual supports in revise
+        self.CBJ_FLAG = CBJ # conflict-directed backjumping and nogood learning
+        self.WDEG_FLAG = WDEG # dom/wdeg (when choosing variable)
+        self.ACTIVITY_FLAG = ACTIVITY # dom/activity (when choosing variable)
         self.PRINT_FLAG = print
+        self.PROFILE_FLAG = profile
+        self.on_assign = on_assign
+        self.on_backtrack = on_backtrack
+        self.on_wipeout = on_wipeout
+        self.random = None if seed is None else random.Random(seed)
+
+        if WDEG and ACTIVITY:
+            raise ValueError("WDEG and ACTIVITY cannot both be used")
+
+        if restarts not in (None, "luby", "geometric"):
+            raise ValueError("restarts must be None, \"luby\" or \"geometric\"")
+        # a run with no budget would restart at every node and never finish
+        if restarts is not None and restart_base < 1:
+            raise ValueError("restart_base must be at least 1")
+        if restarts == "geometric" and restart_factor <= 1:
+            raise ValueError("restart_factor must be more than 1")
+
+        self.restart_schedule = restarts
+        self.restart_base = restart_base
+        self.restart_factor = restart_factor
+        self.keep_learned = keep_learned
+        if restarts is not None and self.random is None:
+            self.random = random.Random(0)
+
+        # learned across restarts: variable -> its last value, and its number of dead ends
+        self.saved_values = {}
+        self.failures = {variable: 0 for variable in neighbors}
+
+        # for MAC: how often each variable has lost values, and how often its
+        # neighbor had when an arc into it was last revised
+        self.changes = {variable: 0 for variable in neighbors}
+        self.revised_at = {} # (x,y) -> self.changes[y] at that revise
+
+        # for CBJ: variable -> the assigned variables whose values pruned its domain
+        # (directly or through propagation), undone through its own trail
+        self.culprits = {variable: set() for variable in neighbors}
+        self.culprit_trail = [] # list of (variable, culprits added)
+        self.conflict = set() # culprits of the last failed propagation
+        self.nogoods = NogoodStore(max_nogoods)
+        self.max_nogood_size = max_nogood_size
+
+        # for WDEG: constraint scope -> weight, and variable -> the scopes it is in
+        self.weights = {scope: 1 for scope in constraints}
+        self.scopes_of = {variable: [] for variable in neighbors}
+        for scope in constraints:
+            for variable in scope:
+                self.scopes_of[variable].append(scope)
+
+        # for ACTIVITY: variable -> activity, and how much the next prune adds to it
+        self.activity = {variable: 0.0 for variable in neighbors}
+        self.activity_bump = 1.0
+        self.activity_decay = activity_decay
+
+        # the unassigned variables by their key, when variables are chosen by a key
+        # alone (WDEG, ACTIVITY, or MRV without DH or random ties). kept up to date
+        # with every domain change, so choosing a variable is O(log n), not a scan
+        self.queue = None
+        if WDEG:
+            self.variable_key = self.wdeg_key
+        elif ACTIVITY:
+            self.variable_key = self.activity_key
+        elif MRV and not DH and self.random is None:
+            self.variable_key = self.domain.size
+        else:
+            self.variable_key = None
 
         self.nodes_visited = 0
+        self.propagations = 0 # forward checks, arc revisions and n-ary propagations
+        self.backtracks = 0 # choice points whose every value failed
+        self.max_depth = 0 # deepest the stack of choice points went
+        self.pruned = {} # kind of propagator -> values it pruned (see profile)
+        self.backjumps = 0 # dead ends which jumped back over more than one level
+        self.nogoods_learned = 0
+        self.nogood_prunings = 0 # values removed (or assignments refused) by nogoods
+        self.restarts_done = 0
+        self.restart_at = None # nodes_visited at which the current run is cut off
+
+        # search state, kept on the object so a search can be paused and resumed
+        self.assignment = None
+        self.unassigned_vars = None # dict (variable -> None), in the order variables were given
+        self.stack = [] # choice points: [variable, values, index of next value, domain mark, culprit mark, conflict set]
+        self.finished = True
+        self.result = None
+
+        # for count_solutions with components: list of (variables, problem over
+        # them), built on first use, and (variables, their domains) -> cached count
+        self.component_problems = None
+        self.component_counts = {}
+
+        # seconds spent building the problem, propagating at the root, and searching
+        self.times = {"setup" : time.perf_counter() - t, "root" : 0.0, "search" : 0.0}
+
+        # the counters of the last search, gathered into a SearchStats
+    def stats(self):
+        return SearchStats(self)
+
+        # method which runs the search to the end, or for at most max_nodes nodes (then
+        # the result is None with self.finished False, as nothing was proven)
+    def get_assignment(self, max_nodes = None):
+        self.start_search()
+        self.resume(max_nodes)
+        return self.result
+
+        # get_assignment with limits, for callers which must answer in time. the
+        # search stops after max_nodes nodes or timeout seconds (or at deadline, a
+        # time.monotonic() value), or once cancel (anything with is_set(), such as a
+        # threading.Event) is set. these are checked every check_every nodes, so a
+        # check costs nothing per node. returns a SearchResult, whose status is SAT,
+        # UNSAT, TIMEOUT (for the node budget too) or CANCELLED, along with the most
+        # complete assignment seen at any check. after TIMEOUT or CANCELLED, resume
+        # carries on with the same search
+    def solve(self, max_nodes = None, timeout = None, deadline = None, cancel = None, check_every = 50):
+        if timeout is not None:
+            deadline = time.monotonic() + timeout if deadline is None else min(deadline, time.monotonic() + timeout)
+
+        self.start_search()
+        stop_at = None if max_nodes is None else self.nodes_visited + max_nodes
+        best = None
+        best_assigned = -1
+
+        while True:
+            assigned = len(self.assignment) - len(self.unassigned_vars)
+            if assigned > best_assigned:
+                best = list(self.assignment)
+                best_assigned = assigned
+
+            if self.finished:
+                status = UNSAT if self.result is None else SAT
+                break
+            if cancel is not None and cancel.is_set():
+                status = CANCELLED
+                break
+            if (deadline is not None and time.monotonic() >= deadline) or (stop_at is not None and self.nodes_visited >= stop_at):
+                status = TIMEOUT
+                break
+
+            self.resume(check_every if stop_at is None else min(check_every, stop_at - self.nodes_visited))
+
+        if self.result is not None:
+            best = list(self.result)
+
+        return SearchResult(status, None if self.result is None else list(self.result), best, self.stats())
+
+        # sets up a new search from the root, without running it yet. given a cube
+        # (decisions: tuple of (variable, value), and a domain snapshot taken after
+        # those decisions were propagated), it searches only below that cube instead
+    def start_search(self, cube = None):
+        self.nodes_visited = 0
+        self.propagations = 0
+        self.backtracks = 0
+        self.max_depth = 0
+        self.pruned = {}
+        self.times["root"] = 0.0
+        self.times["search"] = 0.0
+        self.backjumps = 0
+        self.nogoods_learned = 0
+        self.nogood_prunings = 0
+        self.culprits = {variable: set() for variable in self.neighbors}
+        self.culprit_trail = []
+        self.restarts_done = 0
+        self.restart_at = None if self.restart_schedule is None else self.__run_budget(1)
+        self.unassigned_vars = dict.fromkeys(self.neighbors)
+        self.assignment = [None] * len(self.neighbors)
+        self.stack = []
+        self.finished = False
+        self.result = None
+        self.queue = None
+
+        if cube is not None:
+            decisions, snapshot = cube
+            self.domain.restore(snapshot)
+            self.revised_at = {}
+            # nogoods learned below another cube leave out that cube's decisions
+            self.nogoods.clear()
+            for variable, value in decisions:
+                self.assignment[variable] = value
+                del self.unassigned_vars[variable]
+
+        else:
+            # back to the domain as it was given (or loaded): an earlier search may
+            # have left it pruned
+            self.domain.undo(0)
+
+            # MAC starts from an arc consistent domain, so only changes need propagating
+            if self.AC3_FLAG and self.MAC_FLAG:
+                t = time.perf_counter()
+                self.revised_at = {}
+                consistent = self.ac3()
+                self.times["root"] = time.perf_counter() - t
+
+                if not consistent:
+                    self.nodes_visited = 1
+                    self.finished = True
+                    return
+
+        if self.variable_key is not None:
+            self.queue = VariableQueue(self.variable_key, self.unassigned_vars)
+
+        if self.visit_node():
+            self.finished = True
+            self.result = self.assignment
+        elif not self.stack:
+            self.finished = True
+
+        # yields every solution in turn, as a tuple (a copy, so they can be kept).
+        # the search only goes on to the next one when it is asked for. restarts
+        # are not used, as they would find the same solutions again.
+    def iter_solutions(self):
+        self.start_search()
+        self.restart_at = None
+        found = False
+
+        try:
+            while True:
+                self.resume()
+                if self.result is None:
+                    return
+
+                found = True
+                yield tuple(self.result)
+
+                # nothing was left to choose, so that was the only one
+                if not self.stack:
+                    return
+
+                # carry on as if the solution had been a failed leaf
+                self.finished = False
+                self.result = None
+                self.__leaf_failed(self.stack[-1])
+        finally:
+            # CBJ: nogoods learned once there were solutions below only mean that
+            # part of the tree was enumerated, which another search cannot rely on
+            if found:
+                self.nogoods.clear()
+
+        # the number of solutions, stopping at limit (2 is enough to tell whether a
+        # puzzle's solution is unique). with components, each connected component is
+        # counted on its own and the counts multiplied. a component's count is
+        # cached against its domain, so it is not searched again while it stays the
+        # same (after set_domain changed another part of the problem, for example)
+    def count_solutions(self, limit = None, components = False):
+        if limit is not None and limit <= 0:
+            return 0
+
+        if components:
+            return self.__count_components(limit)
+
+        count = 0
+        for solution in self.iter_solutions():
+            count += 1
+            if limit is not None and count >= limit:
+                break
+
+        return count
+
+    def __count_components(self, limit):
+        if self.component_problems is None:
+            self.component_problems = []
+            initial = {variable: self.domain.order[variable] for variable in self.neighbors}
+
+            for variables in components(self.neighbors, self.constraints):
+                neighbors, domain, constraints = subproblem(variables, self.neighbors, initial, self.constraints)
+                problem = ConstraintSatisfactionProblem(neighbors, domain, constraints, self.MRV_FLAG, self.DH_FLAG, self.LCV_FLAG, self.AC3_FLAG, False, self.backend,
+                                                        MAC = self.MAC_FLAG, AC3rm = self.AC3rm_FLAG, CBJ = self.CBJ_FLAG, WDEG = self.WDEG_FLAG, ACTIVITY = self.ACTIVITY_FLAG)
+                self.component_problems.append((variables, problem))
+
+        # like any search, this starts from the domain as it was given
+        self.domain.undo(0)
+        self.stack = []
+        self.finished = True
+        total = 1
+
+        for variables, problem in self.component_problems:
+            domain = tuple(frozenset(self.domain.values(variable)) for variable in variables)
+            key = (tuple(variables), domain)
+            cached = self.component_counts.get(key)
+
+            # cached: (count, whether it is exact rather than cut off at a limit)
+            if cached is not None and (cached[1] or (limit is not None and cached[0] >= limit)):
+                count = cached[0]
+            else:
+                problem.set_domain(dict(enumerate(domain)))
+                count = problem.count_solutions(limit)
+                self.component_counts[key] = (count, limit is None or count < limit)
+
+            # with every component solvable, the product is at least each count
+            if count == 0:
+                return 0
+            total *= count
+
+        return total if limit is None else min(total, limit)
+
+        # main method for finding solution. backtracking search driven by an explicit
+        # stack of choice points instead of recursion, so its depth is not limited by
+        # python's recursion limit. returns True once the search is over (self.result
+        # holds the solution or None), or False if it stopped after max_nodes nodes.
+    def resume(self, max_nodes = None):
+        t = time.perf_counter()
+        try:
+            return self.__search(max_nodes)
+        finally:
+            self.times["search"] += time.perf_counter() - t
+
+    def __search(self, max_nodes):
+        stop_at = None if max_nodes is None else self.nodes_visited + max_nodes
+
+        while not self.finished:
+            if stop_at is not None and self.nodes_visited >= stop_at:
+                return False
+
+            if self.restart_at is not None and self.nodes_visited >= self.restart_at:
+                self.__restart()
+                continue
 
-        # method which calls recursion
-    def get_assignment(self):
-        # t = time.time()
-        solution = self.backtrack_recursion()
-        # print("Time (s): " + str(time.time() - t))
-        return solution
+            frame = self.stack[-1]
+            variable, values, index, domain_save = frame[0], frame[1], frame[2], frame[3]
 
-        # main method for finding solution
-    def backtrack_recursion(self, unassigned_vars = None, assignment = None):
-        self.nodes_visited += 1
+            # if we are here, there was nothing we could validly assign at this stage
+            if index == len(values):
+                self.failures[variable] += 1
+                self.backtracks += 1
+                if self.on_backtrack is not None:
+                    self.on_backtrack(variable)
+
+                if self.CBJ_FLAG:
+                    self.__backjump()
+                    continue
+
+                self.stack.pop()
+                self.__unassign(variable)
+
+                if not self.stack:
+                    self.finished = True
+                else:
+                    self.__child_failed(self.stack[-1])
+                continue
+
+            value = values[index]
+            frame[2] = index + 1
+
+            if self.PRINT_FLAG:
+                print("Choosing value: " + str(value))
+            # assign the value
+            self.assignment[variable] = value
+            self.saved_values[variable] = value
+            if self.on_assign is not None:
+                self.on_assign(variable, value)
+
+            # constrain domain (forward check)
+            self.forward_check(variable, value)
+
+            # run inference, and with CBJ check the nogoods. False if our assignment causes failure
+            consistent = not ((self.CBJ_FLAG and not self.check_nogoods(variable, value)) or (self.AC3_FLAG and not self.inference(domain_save)))
+
+            # the variables whose domains shrank need their keys updated
+            if self.queue is not None:
+                self.__propagated(domain_save)
+
+            if not consistent:
+                if self.CBJ_FLAG:
+                    frame[5].update(self.conflict)
+                    frame[5].discard(variable)
+                self.__undo(frame)
+                continue
+
+            # go one level deeper. if True, we found a solution!
+            res = self.visit_node()
+            if res:
+                self.finished = True
+                self.result = self.assignment
+            elif res is False:
+                self.__leaf_failed(frame)
+
+        return True
 
-        if assignment == None:
-            self.nodes_visited = 1
-            unassigned_vars = list(self.neighbors.keys()) 
-            assignment = [None] * len(self.neighbors)
+        # enters a node of the search tree. returns True for a solution, False for a
+        # failed leaf, or None after pushing the node's choice point
+    def visit_node(self):
+        self.nodes_visited += 1
 
         if self.PRINT_FLAG:
             print("")
-            print("Current assignment: " + str(assignment))
+            print("Current assignment: " + str(self.assignment))
             print("Current domain: " + str(self.domain))
 
         # every variable has an assignment, so check if it's good else stop going deeper.
-        if not unassigned_vars:
-            if self.is_valid(assignment):
-                print("Valid solution found.")
+        if not self.unassigned_vars:
+            if self.is_valid(self.assignment):
                 if self.PRINT_FLAG:
+                    print("Valid solution found.")
                     print("Nodes visited: " + str(self.nodes_visited))
+                    if self.CBJ_FLAG:
+                        print("Backjumps: " + str(self.backjumps) + ". Nogoods learned: " + str(self.nogoods_learned) + ". Nogood prunings: " + str(self.nogood_prunings))
 
-                return assignment
-            return None
+                return True
+            return False
 
-        domain_save = self.domain
+        # everything pruned below this node is undone by returning to this mark
+        domain_save = self.domain.mark()
         # next variable to assign
-        variable = self.get_variable(unassigned_vars)
+        variable = self.get_variable(self.unassigned_vars)
+
+        # with WDEG, its neighbors now have one variable less to count weights on
+        if self.WDEG_FLAG:
+            self.__rekey(self.neighbors[variable])
         if self.PRINT_FLAG:
             print("Now handling variable: " + str(variable))
 
         # values to consider, ordered if LCV is enabled
-        values = self.get_values(variable, unassigned_vars)
+        values = self.get_values(variable, self.unassigned_vars)
 
-        for value in values:
-            if self.PRINT_FLAG:
-                print("Choosing value: " + str(value))
-            # assign the value
-            assignment[variable] = value
+        # after a restart, a variable first tries the value it had last
+        if self.restarts_done and self.saved_values.get(variable) in values:
+            values.remove(self.saved_values[variable])
+            values.insert(0, self.saved_values[variable])
 
-            # constrain domain (forward check)
-            self.domain = self.forward_check(variable, value)
+        self.stack.append([variable, values, 0, domain_save, len(self.culprit_trail), set()])
+        if len(self.stack) > self.max_depth:
+            self.max_depth = len(self.stack)
+        return None
 
-            # run inference
-            if self.AC3_FLAG and not self.ac3(): # False if our assignment causes failure
-                self.domain = domain_save
-                continue
+        # the number of nodes the run-th run (from 1) may visit
+    def __run_budget(self, run):
+        if self.restart_schedule == "luby":
+            return self.restart_base * luby(run)
 
-            # recurse
-            res = self.backtrack_recursion(unassigned_vars, assignment)
+        return max(1, int(self.restart_base * self.restart_factor ** (run - 1)))
 
-            # if not None, we found a solution!
-            if res:
-                return res
+        # abandons the current run and starts again from the root (below the cube,
+        # if there is one), keeping what was learned if keep_learned is set
+    def __restart(self):
+        self.restarts_done += 1
+        self.restart_at = self.nodes_visited + self.__run_budget(self.restarts_done + 1)
 
-            if self.PRINT_FLAG:
-                print("No solution for value " + str(value))
+        if self.PRINT_FLAG:
+            print("Restarting after " + str(self.nodes_visited) + " nodes")
+
+        if self.stack:
+            self.__undo(self.stack[0])
+
+        for frame in self.stack:
+            self.__unassign(frame[0])
+        self.stack = []
+
+        if not self.keep_learned:
+            self.nogoods.clear()
+            self.saved_values = {}
+            self.failures = {variable: 0 for variable in self.neighbors}
+            self.weights = dict.fromkeys(self.weights, 1)
+            self.activity = dict.fromkeys(self.activity, 0.0)
+            self.activity_bump = 1.0
+            if self.queue is not None:
+                self.queue = VariableQueue(self.variable_key, self.unassigned_vars)
+
+        if self.visit_node():
+            self.finished = True
+            self.result = self.assignment
+        elif not self.stack:
+            self.finished = True
+
+        # the full assignment below frame is not (or no longer wanted as) a solution
+    def __leaf_failed(self, frame):
+        # with CBJ, every variable is to blame
+        if self.CBJ_FLAG:
+            frame[5].update(other for other in range(0, len(self.assignment), 1) if self.assignment[other] is not None and other != frame[0])
+        self.__child_failed(frame)
+
+        # the value last tried at frame led nowhere
+    def __child_failed(self, frame):
+        if self.PRINT_FLAG:
+            print("No solution for value " + str(frame[1][frame[2] - 1]))
 
-            # remove our forward checking and inference
-            self.domain = domain_save
+        # remove our forward checking and inference
+        self.__undo(frame)
 
-        # if we are here, there was nothing we could validly assign at this stage
-        assignment[variable] = None
-        unassigned_vars.append(variable)
-        return None
+        # takes the domain (and the culprits) back to the state frame was entered in
+    def __undo(self, frame):
+        if self.queue is None:
+            self.domain.undo(frame[3])
+        else:
+            changed = self.domain.changed_since(frame[3])
+            self.domain.undo(frame[3])
+            self.__rekey(changed)
+
+        if self.CBJ_FLAG:
+            trail = self.culprit_trail
+            while len(trail) > frame[4]:
+                variable, added = trail.pop()
+                self.culprits[variable].difference_update(added)
+
+        # CBJ: every value of the top frame's variable failed. the variables to blame
+        # are those behind its failures and whatever pruned its domain beforehand.
+        # they can never all keep their values, so that is learned as a nogood, and
+        # the search jumps back to the deepest of them, skipping every choice point
+        # in between (none of those could change the outcome).
+    def __backjump(self):
+        frame = self.stack[-1]
+        conflict = frame[5] | self.culprits[frame[0]]
+        conflict.discard(frame[0])
+
+        if conflict and len(conflict) <= self.max_nogood_size:
+            if self.nogoods.add((other, self.assignment[other]) for other in conflict):
+                self.nogoods_learned += 1
+
+        depths = {frame[0]: depth for depth, frame in enumerate(self.stack)}
+        target = max([depths[other] for other in conflict if other in depths], default = -1)
+
+        if len(self.stack) - target > 2:
+            self.backjumps += 1
+
+        while len(self.stack) > target + 1:
+            popped = self.stack.pop()
+            self.__unassign(popped[0])
+
+        # nobody to blame: there is no solution at all
+        if target == -1:
+            self.finished = True
+            return
+
+        frame = self.stack[-1]
+        if self.PRINT_FLAG:
+            print("Backjumping to variable " + str(frame[0]))
+
+        frame[5].update(conflict)
+        frame[5].discard(frame[0])
+        self.__child_failed(frame)
+
+        # takes variable's value back, and puts it back among the unassigned variables
+    def __unassign(self, variable):
+        self.assignment[variable] = None
+        self.unassigned_vars[variable] = None
+
+        if self.queue is not None:
+            self.queue.push(variable)
+            if self.WDEG_FLAG:
+                self.__rekey(self.neighbors[variable])
+
+        # files the unassigned ones of variables again under their current keys
+    def __rekey(self, variables):
+        queue = self.queue
+        for variable in variables:
+            if variable in queue:
+                queue.push(variable)
+
+        # after an assignment was propagated (whether or not it failed): the pruned
+        # variables gain activity, and get new keys
+    def __propagated(self, mark):
+        changed = self.domain.changed_since(mark)
+
+        if self.ACTIVITY_FLAG:
+            for variable in changed:
+                self.activity[variable] += self.activity_bump
+            # growing the bump is the same as decaying every other activity
+            self.activity_bump /= self.activity_decay
+
+            # keep the numbers in range. dividing everything keeps the order, but
+            # not the keys, so the queue is built again
+            if self.activity_bump > 1e100:
+                for variable in self.activity:
+                    self.activity[variable] *= 1e-100
+                self.activity_bump *= 1e-100
+                self.queue = VariableQueue(self.variable_key, self.unassigned_vars)
+                return
+
+        self.__rekey(changed)
+
+        # the constraint on scope wiped out a domain
+    def wipeout(self, scope):
+        if self.WDEG_FLAG:
+            self.bump_weight(scope)
+        if self.on_wipeout is not None:
+            self.on_wipeout(scope)
+
+        # WDEG: the constraint on scope wiped out a domain
+    def bump_weight(self, scope):
+        if scope not in self.weights:
+            scope = (scope[1], scope[0])
+
+        self.weights[scope] += 1
+
+        if self.queue is not None:
+            self.__rekey(scope)
+
+        # the dom/wdeg key: domain size over the weight of the constraints with
+        # another unassigned variable
+    def wdeg_key(self, variable):
+        wdeg = 0
+        for scope in self.scopes_of[variable]:
+            for other in scope:
+                if other != variable and other in self.unassigned_vars:
+                    wdeg += self.weights[scope]
+                    break
+
+        return self.domain.size(variable) / max(wdeg, 1)
+
+    def activity_key(self, variable):
+        return self.domain.size(variable) / (self.activity[variable] + 1)
+
+        # CBJ: records that the values in culprits are to blame for pruning variable
+    def blame(self, variable, culprits):
+        added = culprits - self.culprits[variable]
+
+        if added:
+            self.culprits[variable].update(added)
+            self.culprit_trail.append((variable, added))
+
+        # CBJ: applies the nogoods containing variable = value. one whose other pairs
+        # all hold refuses the value. one with all but one other pair holding removes
+        # the value of the remaining pair from its (unassigned) variable.
+        # returns False if that leaves nothing, and sets self.conflict
+    def check_nogoods(self, variable, value):
+        for nogood in self.nogoods.containing(variable, value):
+            remaining = None
+
+            for (other, othervalue) in nogood:
+                if self.assignment[other] == othervalue:
+                    continue
+                if remaining is None and self.assignment[other] is None and self.domain.contains(other, othervalue):
+                    remaining = (other, othervalue)
+                    continue
+                break
+            else:
+                self.nogoods.used(nogood)
+                self.nogood_prunings += 1
+                blamed = {other for (other, othervalue) in nogood}
+
+                if remaining is None:
+                    self.conflict = blamed
+                    return False
+
+                other, othervalue = remaining
+                blamed.discard(other)
+                self.domain.discard(other, (othervalue,))
+                self.blame(other, blamed)
+
+                if self.domain.size(other) == 0:
+                    self.conflict = set(self.culprits[other])
+                    return False
+
+        return True
+
+        # reuses the variables and compiled constraints for another instance, whose
+        # domain (map variable -> values) is a subset of the initial one: the same
+        # sudoku with other givens, for example
+    def set_domain(self, domain):
+        self.domain.load(domain)
+        self.revised_at = {}
+        self.nogoods.clear()
+
+        # everything needed to carry on this search later, possibly in another process
+        # (as long as the values can be pickled). restore takes it back.
+    def checkpoint(self):
+        return {
+            "assignment" : list(self.assignment),
+            "unassigned_vars" : list(self.unassigned_vars),
+            "stack" : [[variable, list(values), index, mark, culprit_mark, set(conflict)] for variable, values, index, mark, culprit_mark, conflict in self.stack],
+            "domain" : self.domain.snapshot(),
+            "changes" : dict(self.changes),
+            "revised_at" : dict(self.revised_at),
+            "culprits" : {variable: set(culprits) for variable, culprits in self.culprits.items()},
+            "culprit_trail" : list(self.culprit_trail),
+            "nogoods" : list(self.nogoods.nogoods),
+            "nodes_visited" : self.nodes_visited,
+            "propagations" : self.propagations,
+            "backtracks" : self.backtracks,
+            "max_depth" : self.max_depth,
+            "backjumps" : self.backjumps,
+            "nogoods_learned" : self.nogoods_learned,
+            "nogood_prunings" : self.nogood_prunings,
+            "restarts_done" : self.restarts_done,
+            "restart_at" : self.restart_at,
+            "saved_values" : dict(self.saved_values),
+            "failures" : dict(self.failures),
+            "weights" : dict(self.weights),
+            "activity" : dict(self.activity),
+            "activity_bump" : self.activity_bump,
+            "random" : None if self.random is None else self.random.getstate(),
+            "finished" : self.finished,
+            "result" : None if self.result is None else list(self.result),
+        }
+
+    def restore(self, checkpoint):
+        self.assignment = list(checkpoint["assignment"])
+        self.unassigned_vars = dict.fromkeys(checkpoint["unassigned_vars"])
+        self.stack = [[variable, list(values), index, mark, culprit_mark, set(conflict)] for variable, values, index, mark, culprit_mark, conflict in checkpoint["stack"]]
+        self.domain.restore(checkpoint["domain"])
+        self.changes = dict(checkpoint["changes"])
+        self.revised_at = dict(checkpoint["revised_at"])
+        self.culprits = {variable: set(culprits) for variable, culprits in checkpoint["culprits"].items()}
+        self.culprit_trail = list(checkpoint["culprit_trail"])
+        self.nogoods.clear()
+        for nogood in checkpoint["nogoods"]:
+            self.nogoods.add(nogood)
+        self.nodes_visited = checkpoint["nodes_visited"]
+        self.propagations = checkpoint["propagations"]
+        self.backtracks = checkpoint["backtracks"]
+        self.max_depth = checkpoint["max_depth"]
+        self.backjumps = checkpoint["backjumps"]
+        self.nogoods_learned = checkpoint["nogoods_learned"]
+        self.nogood_prunings = checkpoint["nogood_prunings"]
+        self.restarts_done = checkpoint["restarts_done"]
+        self.restart_at = checkpoint["restart_at"]
+        self.saved_values = dict(checkpoint["saved_values"])
+        self.failures = dict(checkpoint["failures"])
+        self.weights = dict(checkpoint["weights"])
+        self.activity = dict(checkpoint["activity"])
+        self.activity_bump = checkpoint["activity_bump"]
+        if self.variable_key is not None and self.unassigned_vars is not None:
+            self.queue = VariableQueue(self.variable_key, self.unassigned_vars)
+        if checkpoint["random"] is not None:
+            self.random.setstate(checkpoint["random"])
+        self.finished = checkpoint["finished"]
+        self.result = checkpoint["result"]
 
         # returns the next variable to look at and removes it from unassigned_vars
     def get_variable(self, unassigned_vars):
+        # the lowest key (dom/wdeg, dom/activity, or MRV), ties to the lowest variable
+        if self.queue is not None:
+            min_var = self.queue.pop()
+            del unassigned_vars[min_var]
+            return min_var
+
         # MRV
         if self.MRV_FLAG:
             min_vars = set() # holds MRV, set in the case of ties
             mrv = None       # our current best MRV integer
 
             for var in unassigned_vars:
-                if mrv is None or len(self.domain[var]) < mrv:
+                size = self.domain.size(var)
+
+                if mrv is None or size < mrv:
                     min_vars = set() # new best case, empty the set
                     min_vars.add(var)
-                    mrv = len(self.domain[var])
+                    mrv = size
 
-                elif len(self.domain[var]) == mrv: # tie case, add it to the set
+                elif size == mrv: # tie case, add it to the set
                     min_vars.add(var)
 
             # if DH is not enabled, pop a random minimum remaining values var
             if len(min_vars) == 1 or not self.DH_FLAG:
-                min_var = min_vars.pop()
+                if self.random is None:
+                    min_var = min_vars.pop()
+                elif self.restart_schedule is not None:
+                    # the variables which hit the most dead ends so far go first
+                    worst = max(self.failures[var] for var in min_vars)
+                    min_var = self.random.choice(sorted(var for var in min_vars if self.failures[var] == worst))
+                else:
+                    min_var = self.random.choice(sorted(min_vars))
             # if DH is enabled, break the tie with it.
             else:
                 min_var = self.get_variable_DegreeHeuristic(min_vars)
 
-            unassigned_vars.remove(min_var)
+            del unassigned_vars[min_var]
             return min_var
 
         # Degree Heuristic
         elif self.DH_FLAG:
-            return self.get_variable_DegreeHeuristic(unassigned_vars)
+            min_var = self.get_variable_DegreeHeuristic(unassigned_vars)
+            del unassigned_vars[min_var]
+            return min_var
 
         # No heuristic
         else:
-            return unassigned_vars.pop()
-
-        # method in which DH operates
-    def get_variable_DegreeHeuristic(self, unassigned_vars):
-        min_var = None
-        min_var_num = 0 # lowest degree found so far
-
-
-        for var in unassigned_vars:
+            return unassigned_vars.popitem()[0]
+
+        # method in which DH operates: of candidates, the variable with the most
+        # unassigned neighbors. ties go to the smallest domain, then the lowest
+        # variable, so the choice does not depend on the order of candidates
+        # (unassigned_vars is reordered by backtracking)
+    def get_variable_DegreeHeuristic(self, candidates):
+        max_var = None
+        max_var_key = None # best (degree, -domain size, -variable) found so far
+
+        for var in candidates:
+            # unassigned_vars is a dict, so each lookup is O(1)
             num_neighbors = 0
-
             for neighbor in self.neighbors[var]:
-                # if the neighbor is unassigned, increment it
-                if neighbor in unassigned_vars and num_neighbors <= min_var_num:
-                    if var < neighbor:
-                        num_neighbors += 1 # len(self.constraints[(var, neighbor)])
-                    else:
-                        num_neighbors += 1 # len(self.constraints[(neighbor, var)])
+                if neighbor in self.unassigned_vars and neighbor != var:
+                    num_neighbors += 1
 
-                # we have a new best case, so update
-                elif min_var is None or num_neighbors > min_var_num:
-                    min_var = var
-                    min_var_num = num_neighbors
-                    # no need to keep going...
-                    break
+            # we have a new best case, so update
+            key = (num_neighbors, -self.domain.size(var), -var)
+            if max_var_key is None or key > max_var_key:
+                max_var = var
+                max_var_key = key
 
-        unassigned_vars.remove(min_var)
-        return min_var
+        return max_var
 
         # returns a (potentially ordered) list of values to check
     def get_values(self, variable, unassigned_vars):
         if self.LCV_FLAG:
             # save some trouble if zero or one choice
-            if len(self.domain[variable]) == 0 or len(self.domain[variable]) == 1:
+            if self.domain.size(variable) <= 1:
                 if self.PRINT_FLAG:
                     print("LCV Map for above variable: " + str(self.domain[variable]))
-                return self.domain[variable]
+                return self.domain.values(variable)
 
             # obtain a map from variable to the number of constraints
-            LCV_map = self.__value_map(variable, unassigned_vars)
+            value_list = self.domain.values(variable)
+            LCV_map = self.__value_map(variable, value_list)
 
             if self.PRINT_FLAG:
                 print("LCV Map for above variable: " + str(LCV_map))
-            value_list = list(self.domain[variable])
             value_list.sort(key = lambda v : LCV_map[v])
 
             return value_list
 
         else:
-            return self.domain[variable]
+            return self.domain.values(variable)
 
-        # helper function which returns the number of allowed combinations of
-        # this value with the unassigned variables
-    def __value_map(self, variable, unassigned_vars):
+        # helper function which returns, for each value of variable, how many values
+        # of its unassigned constraint neighbors it would rule out. assigned ones are
+        # skipped: forward checking already left variable only values they allow.
+    def __value_map(self, variable, values):
         # initialize map from value to number of constraints it is in
-        value_map = {key: 0 for key in self.domain[variable]}
-
-        # loop over all possible unassigned neighbors
-        for i in unassigned_vars:
-            if i < variable:
-                var_pair = (i, variable)
-
-                # find value tuples from i to variable
-                for value in self.domain[variable]:
-                    for ivalue in self.domain[i]:
-                        val_pair = (ivalue, value)
+        value_map = dict.fromkeys(values, 0)
+        domain = self.domain
+        assignment = self.assignment
 
-                        # if this tuple is not in the constraint, that means value restricts ivalue
-                        if var_pair in self.constraints and val_pair not in self.constraints[var_pair]:
-                            value_map[value] += 1
-
-            # given that there's no redundancies in constraints, need to check
-            # this symmetrical case
-            else:
-                var_pair = (variable, i)
+        # loop over the neighbors only, not every unassigned variable
+        for i in self.arcs[variable]:
+            if assignment[i] is not None:
+                continue
 
-                # find value tuples from variable to i
-                for value in self.domain[variable]:
-                    for ivalue in self.domain[i]:
-                        val_pair = (value, ivalue)
+            ruled_out = self.supports[(variable, i)].ruled_out
+            for value in values:
+                value_map[value] += ruled_out(domain, value, i)
 
-                        # if this tuple is not in the constraint, that means value restricts ivalue
-                        if var_pair in self.constraints and val_pair not in self.constraints[var_pair]:
-                            value_map[value] += 1
+        for constraint, others in self.peers[variable]:
+            others = [other for other in others if assignment[other] is None]
+            if others:
+                for value in values:
+                    value_map[value] += constraint.ruled_out(domain, variable, value, others)
 
         return value_map
 
-        # function which returns a domain limited by a variable assignment
+        # function which limits the domain by a variable assignment. removals are
+        # recorded on the domain's trail, so the caller undoes them by mark.
     def forward_check(self, variable, value):
-        rdomain = copy.deepcopy(self.domain)
-        rdomain[variable] = { value }
-
-        # loop over all constraints involving variable
-        # I assume worst case, there is a contraint between two variables which are not neighbors
-        for i in range(0, len(self.neighbors), 1):
-            # identify pair in self.constraints
-            if i < variable:
-                var_pair = (i, variable)
-
-                # consider each value pair. if it's not in the constraint, remove
-                # the value from the domain.
-                for ivalue in set(rdomain[i]):
-                    val_pair = (ivalue, value)
-
-                    if var_pair in self.constraints and val_pair not in self.constraints[var_pair]:
-                        if self.PRINT_FLAG:
-                            print("Removing " + str(val_pair) + " from " + str(var_pair))
-                        rdomain[i].remove(ivalue)
-
-            elif i == variable:
-                continue
-
-            else:
-                var_pair = (variable, i)
-
-                # consider each value pair. if it's not in the constraint, remove
-                # the value from the domain.
-                for ivalue in set(rdomain[i]):
-                    val_pair = (value, ivalue)
+        self.propagations += 1
+        mark = self.domain.mark()
+        self.domain.assign(variable, value)
+        assigned = self.domain.mark() # what variable's own domain lost is not pruning
 
-                    if var_pair in self.constraints and val_pair not in self.constraints[var_pair]:
-                        if self.PRINT_FLAG:
-                            print("Removing " + str(ivalue) + " from " + str(i))
-                        rdomain[i].remove(ivalue)
-
-        return rdomain
+        if self.PRINT_FLAG:
+            for i in self.arcs[variable]:
+                print("Restricting " + str(i) + " to the supports of " + str(value))
 
-    def ac3(self):
+        # only the supports of value survive in each variable constrained with it
+        counted = 0 # pruned by arcs of a kind of their own
+        if variable in self.forwards:
+            self.forwards[variable].forward(self.domain, value)
+        else:
+            for i in self.arcs[variable]:
+                arc = self.supports[(variable, i)]
+                if arc.kind is None:
+                    arc.forward(self.domain, value, i)
+                else:
+                    arc_mark = self.domain.mark()
+                    arc.forward(self.domain, value, i)
+                    counted += self.count_pruned(arc.kind, arc_mark)
+
+        for index in self.globals_of[variable]:
+            scope, constraint = self.globals[index]
+            constraint.forward(self.domain, scope, variable, value)
+
+        if self.PROFILE_FLAG:
+            self.count_pruned("forward checking", assigned, counted)
+
+        # a constraint which left a neighbor with nothing wiped it out. (each
+        # constraint forward checks a different neighbor, except n-ary ones)
+        if self.WDEG_FLAG or self.on_wipeout is not None:
+            for i in self.arcs[variable]:
+                if self.domain.size(i) == 0:
+                    self.wipeout((variable, i))
+            for index in self.globals_of[variable]:
+                scope = self.globals[index][0]
+                if any(self.domain.size(other) == 0 for other in scope):
+                    self.wipeout(scope)
+
+        # CBJ: variable is to blame for everything it pruned (its own domain included)
+        if self.CBJ_FLAG:
+            for i in self.domain.changed_since(mark):
+                self.blame(i, { variable })
+
+        # runs AC-3 after an assignment. with MAC, only from the variables pruned
+        # since mark (the assigned one and whatever forward checking removed)
+    def inference(self, mark):
+        if not self.MAC_FLAG:
+            return self.ac3()
+
+        changed = self.domain.changed_since(mark)
+        for variable in changed:
+            self.changes[variable] += 1
+
+        return self.ac3(changed)
+
+        # full AC-3 over every arc, or, given the changed variables, incremental
+        # AC-3 seeded only with the arcs into them. n-ary constraints are
+        # propagated whenever the arcs run dry and one of their variables changed.
+    def ac3(self, changed = None):
         queue = deque()
-
-        for key in self.constraints:
-            queue.append(key)
-            queue.append((key[1], key[0]))
-
-        while queue:
-            arc = queue.popleft()
-            vari = arc[0]
-            varj = arc[1]
-
-            if self.revise(vari, varj):
-                # if no more domain
-                if not self.domain[vari]:
+        pending = deque() # indices of n-ary constraints to propagate
+        queued = set()
+
+        if changed is None:
+            for key in self.constraints:
+                if len(key) == 2:
+                    queue.append(key)
+                    queue.append((key[1], key[0]))
+            pending.extend(range(0, len(self.globals), 1))
+        else:
+            for varj in changed:
+                for vari in self.arcs[varj]:
+                    queue.append((vari, varj))
+                pending.extend(self.globals_of[varj])
+        queued.update(pending)
+
+        while True:
+            while queue:
+                arc = queue.popleft()
+                vari = arc[0]
+                varj = arc[1]
+
+                if changed is not None:
+                    # varj has lost nothing since this arc was last revised
+                    if self.revised_at.get(arc) == self.changes[varj]:
+                        continue
+                    self.revised_at[arc] = self.changes[varj]
+
+                if self.revise(vari, varj):
+                    # whatever pruned varj is to blame for what that pruned from vari
+                    if self.CBJ_FLAG:
+                        self.blame(vari, self.culprits[varj])
+
+                    # if no more domain
+                    if self.domain.size(vari) == 0:
+                        if self.CBJ_FLAG:
+                            self.conflict = set(self.culprits[vari])
+                        if self.WDEG_FLAG or self.on_wipeout is not None:
+                            self.wipeout(arc)
+                        return False
+
+                    if changed is None:
+                        for vark in self.neighbors[vari]:
+                            queue.append((vark, vari))
+                    else:
+                        self.changes[vari] += 1
+                        for vark in self.arcs[vari]:
+                            if vark != varj:
+                                queue.append((vark, vari))
+
+                    for index in self.globals_of[vari]:
+                        if index not in queued:
+                            queued.add(index)
+                            pending.append(index)
+
+            if not pending:
+                return True
+
+            index = pending.popleft()
+            queued.discard(index)
+            scope, constraint = self.globals[index]
+
+            self.propagations += 1
+            mark = self.domain.mark()
+            if self.CBJ_FLAG:
+                self.conflict = set().union(*[self.culprits[variable] for variable in scope])
+
+            consistent = constraint.propagate(self.domain, scope)
+            if self.PROFILE_FLAG:
+                self.count_pruned(type(constraint).__name__, mark)
+
+            if not consistent:
+                if self.WDEG_FLAG or self.on_wipeout is not None:
+                    self.wipeout(scope)
+                return False
+
+            for vari in self.domain.changed_since(mark):
+                if self.CBJ_FLAG:
+                    self.blame(vari, self.conflict)
+                if self.domain.size(vari) == 0:
+                    if self.WDEG_FLAG or self.on_wipeout is not None:
+                        self.wipeout(scope)
                     return False
+                if changed is not None:
+                    self.changes[vari] += 1
 
-                for vark in self.neighbors[vari]:
+                for vark in self.arcs[vari]:
                     queue.append((vark, vari))
-
-        return True
+                for other in self.globals_of[vari]:
+                    if other != index and other not in queued:
+                        queued.add(other)
+                        pending.append(other)
 
     def revise(self, vari, varj):
-        revised = False
-
-        for ivalue in set(self.domain[vari]):
-            if not self.__satisfiable(vari, varj, ivalue):
-                self.domain[vari].remove(ivalue)
-                revised = True
-
-        return revised
-
-    # helper function. if there is a jvalue in domain of varj such that (vari, varj)
-    # has a good relation (ivalue, jvalue), then returns true
-    def __satisfiable(self, vari, varj, ivalue):
-        if vari < varj:
-            var_pair = (vari, varj)
-
-            for jvalue in self.domain[varj]:
-                val_pair = (ivalue, jvalue)
+        self.propagations += 1
+        arc = self.supports.get((vari, varj))
+
+        if arc is None:
+            return False
+
+        if self.PROFILE_FLAG or arc.kind is not None:
+            mark = self.domain.mark()
+            revised = arc.revise_residues(self.domain, vari, varj) if self.AC3rm_FLAG else arc.revise(self.domain, vari, varj)
+            self.count_pruned(arc.kind or type(arc).__name__, mark)
+            return revised
+
+        if self.AC3rm_FLAG:
+            return arc.revise_residues(self.domain, vari, varj)
+
+        return arc.revise(self.domain, vari, varj)
+
+        # adds the values pruned since mark, less those already counted under other
+        # kinds, to those of a kind of propagator. returns how many were added
+    def count_pruned(self, kind, mark, counted = 0):
+        removed = self.domain.removed_since(mark) - counted
+        self.pruned[kind] = self.pruned.get(kind, 0) + removed
+        return removed
+
+        # builds the propagators for both arcs of every constraint, once. allowed-pair
+        # sets become support tables, so propagation is an intersection with the
+        # domain and not a pair lookup. other constraints are evaluated directly.
+    def __compile_constraints(self, domain):
+        supports = {}
+
+        for scope, constraint in self.constraints.items():
+            if len(scope) != 2:
+                continue
 
-                # if there exists a jvalue which satisfies constraint...
-                if var_pair in self.constraints and val_pair in self.constraints[var_pair]:
-                    return True
+            i, j = scope
+            if self.backend == "numpy":
+                supports[(i, j)], supports[(j, i)] = self.__compile_matrix(domain, i, j, constraint)
+            elif isinstance(constraint, (set, frozenset)):
+                supports[(i, j)], supports[(j, i)] = self.__compile_table(domain, i, j, constraint)
+            elif hasattr(constraint, "conflicts"):
+                supports[(i, j)] = ConflictSupports(constraint, True, self.cache_budget)
+                supports[(j, i)] = ConflictSupports(constraint, False, self.cache_budget)
+            elif hasattr(constraint, "allows"):
+                supports[(i, j)] = PredicateSupports(constraint.allows, True, self.cache_budget)
+                supports[(j, i)] = PredicateSupports(constraint.allows, False, self.cache_budget)
+            else:
+                supports[(i, j)] = PredicateSupports(constraint, True, self.cache_budget)
+                supports[(j, i)] = PredicateSupports(constraint, False, self.cache_budget)
+
+            supports[(i, j)].reverse = supports[(j, i)]
+            supports[(j, i)].reverse = supports[(i, j)]
+
+            # what the constraint prunes is counted on its own
+            kind = getattr(constraint, "kind", None)
+            if kind is not None:
+                supports[(i, j)].kind = supports[(j, i)].kind = kind
+
+        return supports
+
+        # support tables for (i,j) and (j,i): value -> encoded supporting values
+    def __compile_table(self, domain, i, j, allowed):
+        isupports = {ivalue: set() for ivalue in domain[i]}
+        jsupports = {jvalue: set() for jvalue in domain[j]}
+
+        for (ivalue, jvalue) in allowed:
+            if ivalue in isupports and jvalue in jsupports:
+                isupports[ivalue].add(jvalue)
+                jsupports[jvalue].add(ivalue)
+
+        itable = {ivalue: self.domain.encode(j, values) for ivalue, values in isupports.items()}
+        jtable = {jvalue: self.domain.encode(i, values) for jvalue, values in jsupports.items()}
+
+        return TableSupports(itable), TableSupports(jtable)
+
+        # compatibility matrices for (i,j) and (j,i), for the numpy backend. built
+        # from the allowed pairs of a set, the conflicts of a built-in constraint,
+        # or else by evaluating the predicate on every pair of values
+    def __compile_matrix(self, domain, i, j, constraint):
+        if isinstance(constraint, (set, frozenset)):
+            matrix = self.domain.matrix(i, j, constraint, True)
+        elif hasattr(constraint, "conflicts"):
+            matrix = self.domain.matrix(i, j, [(ivalue, jvalue) for ivalue in domain[i] for jvalue in constraint.conflicts(ivalue, True)], False)
         else:
-            var_pair = (varj, vari)
-
-            for jvalue in self.domain[varj]:
-                val_pair = (jvalue, ivalue)
+            allows = constraint.allows if hasattr(constraint, "allows") else constraint
+            matrix = self.domain.matrix(i, j, [(ivalue, jvalue) for ivalue in domain[i] for jvalue in domain[j] if allows(ivalue, jvalue)], True)
 
-                # if there exists a jvalue which satisfies constraint...
-                if var_pair in self.constraints and val_pair in self.constraints[var_pair]:
-                    return True
-        # no satisfiable found...
-        return False
+        return MatrixSupports(matrix, self.domain.index[i]), MatrixSupports(matrix.T.copy(), self.domain.index[j])
 
     def is_valid(self, assignment):
-        # loop over all variables
-        for i in range(0, len(assignment) - 1, 1):
-            # loop over all pairs
-            for j in range(i + 1, len(assignment), 1):
-                pair = (assignment[i], assignment[j])
+        # loop over all constrained pairs
+        for (i, j) in self.supports:
+            if i < j and not self.supports[(i, j)].allows(self.domain, assignment[i], assignment[j], j):
+                return False
 
-                if (i, j) in self.constraints and pair not in self.constraints[(i, j)]:
-                    return False
+        for scope, constraint in self.globals:
+            if not constraint.allows([assignment[variable] for variable in scope]):
+                return False
 
         return True
 
@@ -346,5 +1233,115 @@ def test2():
     assignment = problem2.get_assignment()
     print(assignment)
 
+# australia again, counted: 6 colorings of the mainland, times 3 for tasmania (variable 6)
+def test3():
+    neighbors = { 0 : {1, 2}, 1 : {0, 2, 3}, 2 : {0, 1, 3, 4, 5}, 3 : {1, 2, 4},
+                    4 : {2, 3, 5}, 5 : {2, 4}, 6 : set()}
+    colors = { 0, 1, 2 }
+    domain = { variable : colors.copy() for variable in neighbors }
+    colorsneq = { (0,1), (0,2), (1,0), (1,2), (2,0), (2,1) }
+    constraints = { (0,1) : set(colorsneq), (0,2) : set(colorsneq), (1,2) : set(colorsneq), (1,3) : set(colorsneq), (2,3) : set(colorsneq), (2,4) : set(colorsneq), (2,5) : set(colorsneq), (3,4) : set(colorsneq), (4,5) : set(colorsneq) }
+
+    problem3 = ConstraintSatisfactionProblem(neighbors, domain, constraints, print = False)
+    print(problem3.count_solutions())
+    print(problem3.count_solutions(components = True))
+    print(problem3.count_solutions(2)) # more than one
+    for solution in problem3.iter_solutions():
+        print(solution)
+
 # test2()
 # test2()
+
+# a small random problem: each pair of variables is constrained with probability
+# density, by a set of allowed pairs (each allowed with probability 1 - tightness),
+# NotEqual or a predicate, and one group of three may have to be all different
+def random_problem(rng, variables = 6, values = 3, density = 0.5, tightness = 0.3):
+    from Constraints import NotEqual, AllDifferent
+
+    neighbors = {variable: set() for variable in range(0, variables, 1)}
+    domain = {variable: set(range(0, values, 1)) for variable in neighbors}
+    constraints = {}
+
+    for i in range(0, variables - 1, 1):
+        for j in range(i + 1, variables, 1):
+            if rng.random() >= density:
+                continue
+
+            kind = rng.randrange(3)
+            if kind == 0:
+                constraints[(i, j)] = {(a, b) for a in domain[i] for b in domain[j] if rng.random() >= tightness}
+            elif kind == 1:
+                constraints[(i, j)] = NotEqual()
+            else:
+                constraints[(i, j)] = lambda a, b: (a + b) % 3 != 1
+
+            neighbors[i].add(j)
+            neighbors[j].add(i)
+
+    if rng.random() < 0.5:
+        scope = tuple(sorted(rng.sample(range(0, variables, 1), 3)))
+        constraints[scope] = AllDifferent()
+        for variable in scope:
+            neighbors[variable].update(other for other in scope if other != variable)
+
+    return neighbors, domain, constraints
+
+# the number of solutions, by trying every assignment
+def brute_force(neighbors, domain, constraints):
+    import itertools
+
+    count = 0
+    for assignment in itertools.product(*(sorted(domain[variable]) for variable in sorted(neighbors))):
+        for scope, constraint in constraints.items():
+            values = [assignment[variable] for variable in scope]
+            if isinstance(constraint, (set, frozenset)):
+                allowed = tuple(values) in constraint
+            elif len(scope) > 2 or hasattr(constraint, "allows"):
+                allowed = constraint.allows(*values) if len(scope) == 2 else constraint.allows(values)
+            else:
+                allowed = constraint(*values)
+
+            if not allowed:
+                break
+        else:
+            count += 1
+
+    return count
+
+# every backend and configuration against brute force on small random problems: a
+# solution is found exactly when there is one, and is valid, and every way of
+# counting gives the number of solutions
+def test4(problems = 20):
+    rng = random.Random(4)
+    configs = [{}, { "MRV" : False, "LCV" : False, "AC3" : False }, { "DH" : True }, { "MRV" : False, "DH" : True },
+               { "MAC" : True }, { "MAC" : True, "AC3rm" : True }, { "CBJ" : True }, { "CBJ" : True, "MAC" : True },
+               { "restarts" : "luby", "restart_base" : 3 }, { "restarts" : "geometric", "restart_base" : 2, "CBJ" : True },
+               { "WDEG" : True }, { "ACTIVITY" : True }, { "seed" : 1 }]
+    checked = 0
+
+    for problem in range(0, problems, 1):
+        neighbors, domain, constraints = random_problem(rng, density = 0.6, tightness = 0.3 if problem % 2 == 0 else 0.6)
+        expected = brute_force(neighbors, domain, constraints)
+
+        for backend in ("set", "bitset", "numpy"):
+            for config in configs:
+                try:
+                    # the set backend prunes the sets it is given
+                    csp = ConstraintSatisfactionProblem(neighbors, {variable: set(values) for variable, values in domain.items()}, constraints, print = False, backend = backend, **config)
+                except ImportError:
+                    break # no numpy
+
+                assignment = csp.get_assignment()
+                label = "problem {:d}, {:s}, {:s}".format(problem, backend, str(config))
+                assert (assignment is not None) == (expected > 0), label + ": solution " + str(assignment) + ", expected " + str(expected)
+                assert assignment is None or csp.is_valid(assignment), label + ": invalid solution " + str(assignment)
+
+                assert csp.count_solutions() == expected, label + ": count"
+                assert csp.count_solutions(components = True) == expected, label + ": count by components"
+                assert csp.count_solutions(2) == min(expected, 2), label + ": count up to 2"
+                checked += 1
+
+    print("{:d} searches agree with brute force".format(checked))
+
+if __name__ == "__main__":
+    test4()
@@ -0,0 +1,594 @@
+import sys
+
+# binary constraints which ConstraintSatisfactionProblem evaluates directly,
+# instead of through an enumerated set of allowed value pairs. like a set in the
+# constraints map, each one belongs to a pair (i,j) with i<j, and ivalue is
+# always the value of i.
+
+# built-in constraints define allows, and conflicts: the values of the other
+# variable which a value rules out. max_conflicts bounds how many there can be,
+# so revise can skip an arc whose other domain is larger than that.
+class NotEqual:
+    def allows(self, ivalue, jvalue):
+        return ivalue != jvalue
+
+        # first: whether value is the value of i (rather than j)
+    def conflicts(self, value, first):
+        return (value,)
+
+    def max_conflicts(self, first):
+        return 1
+
+# a pair taken out of an all-different group (a sudoku row, for example). it
+# propagates exactly like NotEqual.
+class AllDifferentPair(NotEqual):
+    pass
+
+# values are the bottom-left coordinates of two pieces of size (width, height),
+# which may not overlap. with tables (a RectTables), conflicts are looked up there
+# instead of being listed again on every call
+class RectNoOverlap:
+    def __init__(self, isize, jsize, tables = None):
+        self.isize = isize
+        self.jsize = jsize
+        self.tables = tables
+
+    def allows(self, ivalue, jvalue):
+        iwidth, iheight = self.isize
+        jwidth, jheight = self.jsize
+
+        # i on other side of j, or i on top/below j
+        return (ivalue[0] + iwidth - 1 < jvalue[0] or jvalue[0] + jwidth - 1 < ivalue[0] or
+                ivalue[1] + iheight - 1 < jvalue[1] or jvalue[1] + jheight - 1 < ivalue[1])
+
+        # every position of the other piece which would overlap this piece at value
+    def conflicts(self, value, first):
+        if first:
+            width, height = self.isize
+            owidth, oheight = self.jsize
+        else:
+            width, height = self.jsize
+            owidth, oheight = self.isize
+
+        if self.tables is not None:
+            return self.tables.conflicts((width, height), (owidth, oheight), value)
+
+        x, y = value
+        return [(ox, oy) for ox in range(x - owidth + 1, x + width, 1)
+                         for oy in range(y - oheight + 1, y + height, 1)]
+
+    def max_conflicts(self, first):
+        return (self.isize[0] + self.jsize[0] - 1) * (self.isize[1] + self.jsize[1] - 1)
+
+# two pieces of the same size, which may not overlap, with i's position before
+# j's (x first, then y). for pieces which could swap places in any solution, this
+# keeps only one of the two, so the search does not try both. it has no conflicts,
+# as everything before a position would conflict, and is evaluated as a predicate.
+# what it prunes is counted as "symmetry breaking" (see ConstraintSatisfactionProblem)
+class OrderedRectNoOverlap:
+    kind = "symmetry breaking"
+
+    def __init__(self, size, tables = None):
+        self.size = size
+        self.overlap = RectNoOverlap(size, size, tables)
+
+    def allows(self, ivalue, jvalue):
+        return ivalue < jvalue and self.overlap.allows(ivalue, jvalue)
+
+# a cap on the memory which caches built during the search keep, shared between
+# them: RectTables, and the encodings ConflictSupports and PredicateSupports keep
+# for ruled_out. every entry (and every table, when it is created) is charged its
+# rough size, as counted by sys.getsizeof, before it is kept, and one which would
+# take the total past max_bytes is not kept, only computed again when needed.
+# domains, support tables compiled up front and residues are not charged
+class CacheBudget:
+    def __init__(self, max_bytes = None):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.used = {} # kind of cache -> bytes charged to it
+        self.refused = 0 # entries (or tables) not kept, because of max_bytes
+
+        # true if cost more bytes may be kept, in which case they are charged to kind
+    def charge(self, kind, cost):
+        if self.max_bytes is not None and self.bytes + cost > self.max_bytes:
+            self.refused += 1
+            return False
+
+        self.bytes += cost
+        self.used[kind] = self.used.get(kind, 0) + cost
+        return True
+
+        # the key and value of a dict entry, and its slot in the dict
+    def entry_cost(self, key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + 2 * sys.getsizeof(0)
+
+        # what the caches hold so far, e.g. for sizing a container
+    def footprint(self):
+        return {"bytes" : self.bytes, "max_bytes" : self.max_bytes, "refused" : self.refused, "by_cache" : dict(self.used)}
+
+    def __str__(self):
+        string = "Cached: {:d} bytes".format(self.bytes)
+        if self.max_bytes is not None:
+            string += " of at most {:d}. Entries not kept: {:d}".format(self.max_bytes, self.refused)
+        return string + " (" + ", ".join("{:s} {:d}".format(kind, used) for kind, used in sorted(self.used.items())) + ")\n"
+
+# the conflicts of RectNoOverlap on one n x m board: for a piece of one size at a
+# position, the positions on the board of a piece of another size which overlap
+# it. they only depend on the two sizes and the board, so one table per pair of
+# sizes is shared by every pair of pieces with those sizes, and each entry is
+# only worked out the first time it is asked for, and kept if budget allows
+class RectTables:
+    def __init__(self, n, m, budget = None):
+        self.n = n
+        self.m = m
+        self.budget = CacheBudget() if budget is None else budget
+        self.tables = {} # (size, other size) -> {position -> tuple of conflicting positions}
+        self.entries = 0
+        self.computed = 0 # entries worked out, kept or not
+
+    def conflicts(self, size, osize, value):
+        table = self.tables.get((size, osize))
+        if table is not None:
+            conflicts = table.get(value)
+            if conflicts is not None:
+                return conflicts
+
+        self.computed += 1
+        width, height = size
+        owidth, oheight = osize
+        x, y = value
+
+        # only positions where the other piece fits on the board
+        conflicts = tuple((ox, oy) for ox in range(max(x - owidth + 1, 0), min(x + width, self.n - owidth + 1), 1)
+                                   for oy in range(max(y - oheight + 1, 0), min(y + height, self.m - oheight + 1), 1))
+
+        # a table is only created (and charged) along with its first entry
+        cost = self.budget.entry_cost(value, conflicts) + sum(sys.getsizeof(position) for position in conflicts)
+        if table is None:
+            cost += sys.getsizeof({}) + self.budget.entry_cost((size, osize), None)
+
+        if self.budget.charge("conflict tables", cost):
+            if table is None:
+                table = self.tables[(size, osize)] = {}
+            table[value] = conflicts
+            self.entries += 1
+
+        return conflicts
+
+    def footprint(self):
+        return dict(self.budget.footprint(), tables = len(self.tables), entries = self.entries, computed = self.computed)
+
+    def __str__(self):
+        return "Constraint tables: {:d}, with {:d} positions. ".format(len(self.tables), self.entries) + str(self.budget)
+
+
+# the propagators ConstraintSatisfactionProblem keeps for each arc (x,y). all of
+# them answer the same questions about y for a value of x: forward prunes y by
+# x = value, revise prunes x by y, ruled_out counts the values of y that value
+# removes (for LCV) and allows checks one pair. ruled_out is a count of an
+# encoded set against y's domain, with the encodings worked out once per value.
+
+# revise_residues is revise for AC-3rm: the last support found for each value
+# (its residue) is kept and checked first, and since a support of value in y is
+# also a support the other way, it becomes the residue of the reverse arc too.
+# residues are never undone, as a support stays a support when backtracking.
+# kind is set for the arcs of a constraint whose pruning is counted on its own.
+
+# an enumerated set of allowed pairs, compiled into a table of supports:
+# value of x -> the values of y it is allowed with, encoded by the domain store
+class TableSupports:
+    def __init__(self, supports):
+        self.supports = supports
+        self.residues = {} # value of x -> value of y last found to support it
+        self.reverse = None # the propagator for (y,x), set when both are compiled
+        self.kind = None
+
+    def forward(self, store, value, y):
+        store.restrict(y, self.supports[value])
+
+    def revise(self, store, x, y):
+        supports = self.supports
+        removed = set()
+
+        # value stays only if some value left in y supports it
+        for value in store[x]:
+            if not store.intersects(y, supports[value]):
+                removed.add(value)
+
+        store.prune(x, removed)
+        return len(removed) > 0
+
+    def revise_residues(self, store, x, y):
+        supports = self.supports
+        residues = self.residues
+        reverse = self.reverse.residues
+        removed = set()
+
+        for value in store[x]:
+            if value in residues and store.contains(y, residues[value]):
+                continue
+
+            support = store.find(y, supports[value])
+            if support is None:
+                removed.add(value)
+            else:
+                residues[value] = support
+                reverse[support] = value
+
+        store.prune(x, removed)
+        return len(removed) > 0
+
+    def ruled_out(self, store, value, y):
+        return store.size(y) - store.count(y, self.supports[value])
+
+    def allows(self, store, value, yvalue, y):
+        return store.encoded_contains(y, self.supports[value], yvalue)
+
+# a built-in constraint, propagated through the values each value conflicts with
+class ConflictSupports:
+        # budget: a CacheBudget for encoded, or None to keep every encoding
+    def __init__(self, constraint, first, budget = None):
+        self.constraint = constraint
+        self.first = first # whether x is i in the constraint's pair
+        self.max_conflicts = constraint.max_conflicts(first)
+        self.residues = {}
+        self.reverse = None
+        self.kind = None
+        self.encoded = {} # value of x -> its conflicts in y, encoded (for ruled_out)
+        self.budget = budget
+
+    def forward(self, store, value, y):
+        store.discard(y, self.constraint.conflicts(value, self.first))
+
+    def revise(self, store, x, y):
+        ysize = store.size(y)
+
+        # too many values in y for any value of x to conflict with all of them
+        if ysize > self.max_conflicts:
+            return False
+
+        removed = set()
+
+        for value in store[x]:
+            if store.count_present(y, self.constraint.conflicts(value, self.first)) == ysize:
+                removed.add(value)
+
+        store.prune(x, removed)
+        return len(removed) > 0
+
+    def revise_residues(self, store, x, y):
+        ysize = store.size(y)
+
+        if ysize > self.max_conflicts:
+            return False
+
+        residues = self.residues
+        reverse = self.reverse.residues
+        removed = set()
+
+        for value in store[x]:
+            if value in residues and store.contains(y, residues[value]):
+                continue
+
+            conflicts = set(self.constraint.conflicts(value, self.first))
+            support = next((yvalue for yvalue in store[y] if yvalue not in conflicts), None)
+            if support is None:
+                removed.add(value)
+            else:
+                residues[value] = support
+                reverse[support] = value
+
+        store.prune(x, removed)
+        return len(removed) > 0
+
+    def ruled_out(self, store, value, y):
+        encoded = self.encoded.get(value)
+
+        if encoded is None:
+            encoded = store.encode_known(y, self.constraint.conflicts(value, self.first))
+            keep(self.encoded, value, encoded, self.budget)
+
+        return store.count(y, encoded)
+
+    def allows(self, store, value, yvalue, y):
+        if self.first:
+            return self.constraint.allows(value, yvalue)
+        return self.constraint.allows(yvalue, value)
+
+# any callable predicate(ivalue, jvalue), evaluated against the values of y
+class PredicateSupports:
+    def __init__(self, predicate, first, budget = None):
+        self.predicate = predicate
+        self.first = first
+        self.residues = {}
+        self.reverse = None
+        self.kind = None
+        self.encoded = {} # value of x -> the values of y it does not allow, encoded (for ruled_out)
+        self.budget = budget
+
+    def allows(self, store, value, yvalue, y):
+        if self.first:
+            return self.predicate(value, yvalue)
+        return self.predicate(yvalue, value)
+
+    def forward(self, store, value, y):
+        store.prune(y, [yvalue for yvalue in store[y] if not self.allows(store, value, yvalue, y)])
+
+    def revise(self, store, x, y):
+        removed = set()
+
+        for value in store[x]:
+            if not any(self.allows(store, value, yvalue, y) for yvalue in store[y]):
+                removed.add(value)
+
+        store.prune(x, removed)
+        return len(removed) > 0
+
+    def revise_residues(self, store, x, y):
+        residues = self.residues
+        reverse = self.reverse.residues
+        removed = set()
+
+        for value in store[x]:
+            if value in residues and store.contains(y, residues[value]):
+                continue
+
+            support = next((yvalue for yvalue in store[y] if self.allows(store, value, yvalue, y)), None)
+            if support is None:
+                removed.add(value)
+            else:
+                residues[value] = support
+                reverse[support] = value
+
+        store.prune(x, removed)
+        return len(removed) > 0
+
+        # the predicate is only called once for each pair of values
+    def ruled_out(self, store, value, y):
+        encoded = self.encoded.get(value)
+
+        if encoded is None:
+            encoded = store.encode(y, [yvalue for yvalue in store.order[y] if not self.allows(store, value, yvalue, y)])
+            keep(self.encoded, value, encoded, self.budget)
+
+        return store.count(y, encoded)
+
+# keeps value -> encoded in an arc's cache of encodings, if budget (a CacheBudget,
+# or None for no limit) allows. the dict itself is charged with its first entry
+def keep(cache, value, encoded, budget):
+    if budget is not None:
+        cost = budget.entry_cost(value, encoded)
+        if not cache:
+            cost += sys.getsizeof(cache)
+        if not budget.charge("encodings", cost):
+            return
+
+    cache[value] = encoded
+
+# any binary constraint, for the numpy backend: a boolean compatibility matrix whose
+# row for a value of x says which values of y it is allowed with. revise is a
+# single matrix product with the row of y's domain instead of a loop over values.
+class MatrixSupports:
+    def __init__(self, matrix, index):
+        self.matrix = matrix
+        self.index = index # value of x -> its row in matrix
+        self.residues = {}
+        self.reverse = None
+        self.kind = None
+
+    def forward(self, store, value, y):
+        store.restrict(y, self.matrix[self.index[value]])
+
+    def revise(self, store, x, y):
+        # a value of x stays if its row shares any value with y's domain
+        return store.restrict(x, self.matrix @ store.row(y))
+
+        # one product checks every value at once, so residues have nothing to save
+    def revise_residues(self, store, x, y):
+        return self.revise(store, x, y)
+
+    def ruled_out(self, store, value, y):
+        return store.size(y) - store.count(y, self.matrix[self.index[value]])
+
+    def allows(self, store, value, yvalue, y):
+        return store.encoded_contains(y, self.matrix[self.index[value]], yvalue)
+
+# forward checking of every arc (x,y) out of one variable x at once, for the numpy
+# backend. the matrices of those arcs are stacked, so that a value of x picks out
+# one mask row for each y, and all of them are applied in one masked AND. the arcs
+# keep views into the stack rather than their own copies.
+class StackedSupports:
+        # arcs: list of (y, MatrixSupports for (x,y))
+    def __init__(self, store, arcs):
+        self.index = arcs[0][1].index
+        self.rows, self.masks = store.stack([y for y, arc in arcs], [arc.matrix for y, arc in arcs])
+
+        for k, (y, arc) in enumerate(arcs):
+            arc.matrix = self.masks[:, k, :]
+
+    def forward(self, store, value):
+        store.restrict_rows(self.rows, self.masks[self.index[value]])
+
+# an n-ary constraint: every variable of its scope takes a different value. it is
+# posted in the constraints map under the whole scope, for example
+# constraints[(0, 1, 2, 3)] = AllDifferent(). forward only removes the assigned
+# value from the rest of the scope (like pairwise NotEqual), while propagate
+# enforces generalized arc consistency with Regin's matching algorithm, which
+# also catches hidden singles, naked pairs and so on.
+class AllDifferent:
+    def __init__(self):
+        self.matchings = {} # scope -> last maximum matching (position in scope -> value)
+
+    def allows(self, values):
+        return len(set(values)) == len(values)
+
+    def forward(self, store, scope, variable, value):
+        for other in scope:
+            if other != variable:
+                store.discard(other, (value,))
+
+        # for LCV: how many of others (unassigned variables of the scope) lose value
+    def ruled_out(self, store, variable, value, others):
+        return sum(1 for other in others if store.contains(other, value))
+
+        # removes every value which is in no maximum matching of variables to
+        # values. returns False if there is no matching covering every variable.
+    def propagate(self, store, scope):
+        domains = [store[variable] for variable in scope]
+        match_var, match_val = self.__matching(scope, domains)
+
+        if len(match_var) < len(scope):
+            return False
+
+        # graph over variables (0..k-1) and values: matched edges go variable ->
+        # value, every other edge goes value -> variable
+        k = len(scope)
+        value_node = {}
+        for values in domains:
+            for value in values:
+                if value not in value_node:
+                    value_node[value] = k + len(value_node)
+
+        edges = [[] for i in range(k + len(value_node))]
+        for i in range(k):
+            edges[i].append(value_node[match_var[i]])
+            for value in domains[i]:
+                if value != match_var[i]:
+                    edges[value_node[value]].append(i)
+
+        # an edge is in some maximum matching if it is matched, if both ends are in
+        # one strongly connected component (an even alternating cycle), or if it can
+        # be reached from a free value (an even alternating path)
+        reachable = self.__reachable(edges, [node for value, node in value_node.items() if value not in match_val])
+        component = self.__components(edges)
+
+        for i in range(k):
+            removed = []
+            for value in domains[i]:
+                node = value_node[value]
+                if value != match_var[i] and not reachable[node] and component[node] != component[i]:
+                    removed.append(value)
+            store.discard(scope[i], removed)
+
+        return True
+
+        # maximum matching, grown from the previous one by augmenting paths
+    def __matching(self, scope, domains):
+        match_var = {}
+        match_val = {}
+
+        for i, value in self.matchings.get(scope, {}).items():
+            if value in domains[i] and value not in match_val:
+                match_var[i] = value
+                match_val[value] = i
+
+        for i in range(len(scope)):
+            if i not in match_var and not self.__augment(i, domains, match_var, match_val):
+                break
+
+        self.matchings[scope] = match_var
+        return match_var, match_val
+
+        # iterative search for an alternating path from variable start to a free value
+    def __augment(self, start, domains, match_var, match_val):
+        visited = set()
+        stack = [(start, iter(domains[start]))]
+        chosen = [] # value taken at each level of the stack
+
+        while stack:
+            i, values = stack[-1]
+
+            for value in values:
+                if value in visited:
+                    continue
+                visited.add(value)
+
+                owner = match_val.get(value)
+                if owner is None:
+                    # flip the path: every variable on the stack takes its chosen value
+                    chosen.append(value)
+                    for (j, unused), jvalue in zip(stack, chosen):
+                        match_var[j] = jvalue
+                        match_val[jvalue] = j
+                    return True
+
+                chosen.append(value)
+                stack.append((owner, iter(domains[owner])))
+                break
+            else:
+                stack.pop()
+                if chosen:
+                    chosen.pop()
+
+        return False
+
+    def __reachable(self, edges, starts):
+        reachable = [False] * len(edges)
+        stack = list(starts)
+
+        for node in starts:
+            reachable[node] = True
+
+        while stack:
+            node = stack.pop()
+            for next_node in edges[node]:
+                if not reachable[next_node]:
+                    reachable[next_node] = True
+                    stack.append(next_node)
+
+        return reachable
+
+        # strongly connected component of every node (iterative Tarjan)
+    def __components(self, edges):
+        n = len(edges)
+        index = [None] * n
+        low = [0] * n
+        component = [None] * n
+        on_stack = [False] * n
+        stack = []
+        counter = 0
+        components = 0
+
+        for root in range(n):
+            if index[root] is not None:
+                continue
+
+            work = [(root, 0)]
+            while work:
+                node, position = work.pop()
+
+                if position == 0:
+                    index[node] = low[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+
+                recursed = False
+                for p in range(position, len(edges[node]), 1):
+                    next_node = edges[node][p]
+                    if index[next_node] is None:
+                        work.append((node, p + 1))
+                        work.append((next_node, 0))
+                        recursed = True
+                        break
+                    elif on_stack[next_node]:
+                        low[node] = min(low[node], index[next_node])
+
+                if recursed:
+                    continue
+
+                # node is finished: close its component if it is a root
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = components
+                        if member == node:
+                            break
+                    components += 1
+
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+
+        return component
@@ -0,0 +1,487 @@
+# numpy is optional, and only needed for NumpyDomainStore (backend = "numpy")
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# int.bit_count only exists from python 3.10 onwards
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:
+    def popcount(mask):
+        return bin(mask).count("1")
+
+# holds the domain of every variable for ConstraintSatisfactionProblem. instead
+# of copying the whole domain at every node, each removal is logged on a trail,
+# and backtracking pops the trail back to a saved mark to restore the values.
+class DomainStore:
+        # domain: map (variable -> set of values). the sets are modified in place.
+    def __init__(self, domain):
+        self.domain = domain
+        self.trail = [] # list of (variable, set of removed values)
+
+        # values are always handed out in the order of the initial domain, so the
+        # search does not depend on how the sets happen to be laid out after undos
+        self.order = {variable: list(domain[variable]) for variable in domain}
+
+        # the live set of values for a variable. do not modify it directly.
+    def __getitem__(self, variable):
+        return self.domain[variable]
+
+    def size(self, variable):
+        return len(self.domain[variable])
+
+    def contains(self, variable, value):
+        return value in self.domain[variable]
+
+        # the remaining values of a variable as a list, in initial domain order
+    def values(self, variable):
+        current = self.domain[variable]
+
+        if len(current) == len(self.order[variable]):
+            return list(self.order[variable])
+
+        return [value for value in self.order[variable] if value in current]
+
+        # the first remaining value in initial domain order, None if it is empty
+    def first(self, variable):
+        current = self.domain[variable]
+
+        for value in self.order[variable]:
+            if value in current:
+                return value
+
+        return None
+
+    def __len__(self):
+        return len(self.domain)
+
+    def __str__(self):
+        return str(self.domain)
+
+        # the set representation of some values of a variable
+    def encode(self, variable, values):
+        return set(values)
+
+        # like encode. values outside the domain never match anything anyway
+    def encode_known(self, variable, values):
+        return set(values)
+
+        # true if any remaining value of variable is in encoded
+    def intersects(self, variable, encoded):
+        return not encoded.isdisjoint(self.domain[variable])
+
+        # number of remaining values of variable which are in encoded
+    def count(self, variable, encoded):
+        return len(encoded & self.domain[variable])
+
+    def encoded_contains(self, variable, encoded, value):
+        return value in encoded
+
+        # some remaining value of variable which is in encoded, None if there is none
+    def find(self, variable, encoded):
+        current = self.domain[variable]
+
+        if len(encoded) > len(current):
+            encoded, current = current, encoded
+
+        for value in encoded:
+            if value in current:
+                return value
+
+        return None
+
+        # number of values (which may be outside the domain) still in the domain
+    def count_present(self, variable, values):
+        current = self.domain[variable]
+        return sum(1 for value in values if value in current)
+
+        # returns a position on the trail which undo can later return to
+    def mark(self):
+        return len(self.trail)
+
+        # removes a set of values (all of which must be in the domain) from a variable
+    def prune(self, variable, values):
+        if values:
+            self.domain[variable].difference_update(values)
+            self.trail.append((variable, values))
+
+        # keeps only the values of a variable which are also in keep
+    def restrict(self, variable, keep):
+        self.prune(variable, self.domain[variable] - keep)
+
+        # removes whichever of values (which may be outside the domain) are in it
+    def discard(self, variable, values):
+        self.prune(variable, self.domain[variable].intersection(values))
+
+        # reduces the domain of a variable to a single value
+    def assign(self, variable, value):
+        self.restrict(variable, { value })
+
+        # the variables which lost values since mark was taken, in trail order
+    def changed_since(self, mark):
+        return list(dict.fromkeys(variable for variable, values in self.trail[mark:]))
+
+        # how many values were removed since mark was taken (with nothing undone since)
+    def removed_since(self, mark):
+        return sum(len(values) for variable, values in self.trail[mark:])
+
+        # a copy of the current domains and trail, which restore puts back. without
+        # the trail, undo cannot go back past the point of the snapshot once restored
+    def snapshot(self, trail = True):
+        return ({variable: set(values) for variable, values in self.domain.items()}, list(self.trail) if trail else [])
+
+    def restore(self, snapshot):
+        domain, trail = snapshot
+        for variable, values in domain.items():
+            self.domain[variable] = set(values)
+        self.trail = list(trail)
+
+        # starts over from new domains (map variable -> values, each a subset of the
+        # initial domain), with an empty trail
+    def load(self, domain):
+        for variable, values in domain.items():
+            self.domain[variable] = set(values)
+        self.trail = []
+
+        # puts back every value removed since mark was taken
+    def undo(self, mark):
+        trail = self.trail
+        domain = self.domain
+
+        while len(trail) > mark:
+            variable, values = trail.pop()
+            domain[variable].update(values)
+
+# same interface as DomainStore, but every value of a variable is given an index
+# (its position in the initial domain) and the domain is an int bitmask over those
+# indices. size is a popcount, removal and intersection are single int operations,
+# and the trail only needs to remember the previous mask.
+class BitsetDomainStore:
+        # domain: map (variable -> set of values). only read here, never modified.
+    def __init__(self, domain):
+        self.order = {variable: list(domain[variable]) for variable in domain} # index -> value
+        self.index = {variable: {value: i for i, value in enumerate(self.order[variable])} for variable in domain} # value -> index
+
+        self.domain = {variable: (1 << len(self.order[variable])) - 1 for variable in domain} # variable -> mask
+        self.trail = [] # list of (variable, mask before the change)
+
+        # the remaining values of a variable, in initial domain order
+    def __getitem__(self, variable):
+        return self.values(variable)
+
+    def values(self, variable):
+        order = self.order[variable]
+        mask = self.domain[variable]
+        values = []
+
+        while mask:
+            low = mask & -mask
+            values.append(order[low.bit_length() - 1])
+            mask ^= low
+
+        return values
+
+        # the value with the lowest index still in the domain, None if it is empty
+    def first(self, variable):
+        mask = self.domain[variable]
+
+        if not mask:
+            return None
+
+        return self.order[variable][(mask & -mask).bit_length() - 1]
+
+    def size(self, variable):
+        return popcount(self.domain[variable])
+
+    def contains(self, variable, value):
+        i = self.index[variable].get(value)
+        return i is not None and (self.domain[variable] >> i) & 1 == 1
+
+    def __len__(self):
+        return len(self.domain)
+
+    def __str__(self):
+        return str({variable: set(self.values(variable)) for variable in self.domain})
+
+        # converts values of a variable into a mask
+    def encode(self, variable, values):
+        index = self.index[variable]
+        mask = 0
+
+        for value in values:
+            mask |= 1 << index[value]
+
+        return mask
+
+    def intersects(self, variable, encoded):
+        return self.domain[variable] & encoded != 0
+
+    def count(self, variable, encoded):
+        return popcount(self.domain[variable] & encoded)
+
+    def encoded_contains(self, variable, encoded, value):
+        i = self.index[variable].get(value)
+        return i is not None and (encoded >> i) & 1 == 1
+
+    def find(self, variable, encoded):
+        mask = self.domain[variable] & encoded
+
+        if not mask:
+            return None
+
+        return self.order[variable][(mask & -mask).bit_length() - 1]
+
+        # like encode, but values outside the initial domain are ignored
+    def encode_known(self, variable, values):
+        index = self.index[variable]
+        mask = 0
+
+        for value in values:
+            i = index.get(value)
+            if i is not None:
+                mask |= 1 << i
+
+        return mask
+
+    def count_present(self, variable, values):
+        return popcount(self.domain[variable] & self.encode_known(variable, values))
+
+    def mark(self):
+        return len(self.trail)
+
+        # removes values from a variable. values may be a mask or any iterable of values
+    def prune(self, variable, values):
+        if not isinstance(values, int):
+            values = self.encode(variable, values)
+
+        self.restrict(variable, ~values)
+
+        # keeps only the values of a variable which are in mask (a word-parallel AND)
+    def restrict(self, variable, mask):
+        old = self.domain[variable]
+        new = old & mask
+
+        if new != old:
+            self.trail.append((variable, old))
+            self.domain[variable] = new
+
+    def discard(self, variable, values):
+        self.restrict(variable, ~self.encode_known(variable, values))
+
+    def assign(self, variable, value):
+        self.restrict(variable, 1 << self.index[variable][value])
+
+    def changed_since(self, mark):
+        return list(dict.fromkeys(variable for variable, mask in self.trail[mark:]))
+
+        # a variable's first entry since mark holds its mask at mark
+    def removed_since(self, mark):
+        before = {}
+        for variable, mask in self.trail[mark:]:
+            before.setdefault(variable, mask)
+
+        return sum(popcount(mask) - popcount(self.domain[variable]) for variable, mask in before.items())
+
+    def snapshot(self, trail = True):
+        return (dict(self.domain), list(self.trail) if trail else [])
+
+    def restore(self, snapshot):
+        domain, trail = snapshot
+        self.domain = dict(domain)
+        self.trail = list(trail)
+
+    def load(self, domain):
+        for variable, values in domain.items():
+            self.domain[variable] = self.encode(variable, values)
+        self.trail = []
+
+    def undo(self, mark):
+        trail = self.trail
+        domain = self.domain
+
+        while len(trail) > mark:
+            variable, mask = trail.pop()
+            domain[variable] = mask
+
+# same interface again, for large dense problems: the whole domain is one boolean
+# numpy matrix (variable x value index, values indexed as in BitsetDomainStore and
+# padded to the largest domain). constraints are compiled into compatibility
+# matrices over the same indices (see MatrixSupports), so revising an arc and
+# forward checking every neighbor become whole-row numpy operations.
+class NumpyDomainStore:
+        # domain: map (variable -> set of values). only read here, never modified.
+    def __init__(self, domain):
+        if numpy is None:
+            raise ImportError("the numpy backend needs numpy to be installed")
+
+        self.variables = list(domain) # row -> variable
+        self.rows = {variable: i for i, variable in enumerate(self.variables)} # variable -> row
+        self.order = {variable: list(domain[variable]) for variable in domain} # index -> value
+        self.index = {variable: {value: i for i, value in enumerate(self.order[variable])} for variable in domain} # value -> index
+        self.width = max([len(values) for values in self.order.values()] + [1])
+
+        self.domain = numpy.zeros((len(self.variables), self.width), dtype = bool)
+        for variable, i in self.rows.items():
+            self.domain[i, :len(self.order[variable])] = True
+
+        self.trail = [] # list of (variable, row before the change)
+
+        # the live boolean row of a variable. do not modify it directly.
+    def row(self, variable):
+        return self.domain[self.rows[variable]]
+
+    def __getitem__(self, variable):
+        return self.values(variable)
+
+    def values(self, variable):
+        order = self.order[variable]
+        return [order[i] for i in numpy.flatnonzero(self.row(variable))]
+
+    def first(self, variable):
+        row = self.row(variable)
+        i = int(row.argmax())
+
+        if not row[i]:
+            return None
+
+        return self.order[variable][i]
+
+    def size(self, variable):
+        return int(numpy.count_nonzero(self.row(variable)))
+
+    def contains(self, variable, value):
+        i = self.index[variable].get(value)
+        return i is not None and bool(self.row(variable)[i])
+
+    def __len__(self):
+        return len(self.variables)
+
+    def __str__(self):
+        return str({variable: set(self.values(variable)) for variable in self.variables})
+
+        # converts values of a variable into a boolean row
+    def encode(self, variable, values):
+        index = self.index[variable]
+        row = numpy.zeros(self.width, dtype = bool)
+        row[[index[value] for value in values]] = True
+
+        return row
+
+    def encode_known(self, variable, values):
+        index = self.index[variable]
+        return self.encode(variable, [value for value in values if value in index])
+
+    def intersects(self, variable, encoded):
+        return bool(numpy.logical_and(self.row(variable), encoded).any())
+
+    def count(self, variable, encoded):
+        return int(numpy.count_nonzero(numpy.logical_and(self.row(variable), encoded)))
+
+    def encoded_contains(self, variable, encoded, value):
+        i = self.index[variable].get(value)
+        return i is not None and bool(encoded[i])
+
+    def find(self, variable, encoded):
+        found = numpy.flatnonzero(numpy.logical_and(self.row(variable), encoded))
+
+        if len(found) == 0:
+            return None
+
+        return self.order[variable][found[0]]
+
+    def count_present(self, variable, values):
+        return self.count(variable, self.encode_known(variable, values))
+
+        # a (width x width) matrix for the pair (i,j) which is value for the pairs of
+        # values given (pairs outside the domains are ignored), and not value elsewhere
+    def matrix(self, i, j, pairs, value):
+        iindex = self.index[i]
+        jindex = self.index[j]
+        matrix = numpy.full((self.width, self.width), not value, dtype = bool)
+
+        for (ivalue, jvalue) in pairs:
+            if ivalue in iindex and jvalue in jindex:
+                matrix[iindex[ivalue], jindex[jvalue]] = value
+
+        return matrix
+
+        # the rows of variables, and matrices stacked into (index, variable, index)
+        # so that masks[index] has one row for every one of the variables
+    def stack(self, variables, matrices):
+        return numpy.array([self.rows[variable] for variable in variables], dtype = numpy.intp), numpy.stack(matrices, axis = 1)
+
+    def mark(self):
+        return len(self.trail)
+
+        # removes values from a variable. values may be a boolean row or any iterable of values
+    def prune(self, variable, values):
+        if not isinstance(values, numpy.ndarray):
+            values = self.encode(variable, values)
+
+        self.restrict(variable, ~values)
+
+        # keeps only the values of a variable which are in the boolean row mask.
+        # returns True if that removed anything.
+    def restrict(self, variable, mask):
+        i = self.rows[variable]
+        old = self.domain[i]
+        new = old & mask
+
+        if numpy.array_equal(new, old):
+            return False
+
+        self.trail.append((variable, old.copy()))
+        self.domain[i] = new
+        return True
+
+        # restrict for many variables at once: rows from stack, and one mask row for each
+    def restrict_rows(self, rows, masks):
+        old = self.domain[rows]
+        new = old & masks
+        changed = numpy.flatnonzero((old != new).any(axis = 1))
+
+        if len(changed) == 0:
+            return
+
+        self.domain[rows] = new
+        for k in changed:
+            self.trail.append((self.variables[rows[k]], old[k]))
+
+    def discard(self, variable, values):
+        self.restrict(variable, ~self.encode_known(variable, values))
+
+    def assign(self, variable, value):
+        self.restrict(variable, self.encode(variable, (value,)))
+
+    def changed_since(self, mark):
+        return list(dict.fromkeys(variable for variable, row in self.trail[mark:]))
+
+    def removed_since(self, mark):
+        before = {}
+        for variable, row in self.trail[mark:]:
+            before.setdefault(variable, row)
+
+        return sum(int(numpy.count_nonzero(row)) - self.size(variable) for variable, row in before.items())
+
+    def snapshot(self, trail = True):
+        return (self.domain.copy(), list(self.trail) if trail else [])
+
+    def restore(self, snapshot):
+        domain, trail = snapshot
+        self.domain = domain.copy()
+        self.trail = list(trail)
+
+    def load(self, domain):
+        for variable, values in domain.items():
+            self.domain[self.rows[variable]] = self.encode(variable, values)
+        self.trail = []
+
+    def undo(self, mark):
+        trail = self.trail
+        domain = self.domain
+        rows = self.rows
+
+        while len(trail) > mark:
+            variable, row = trail.pop()
+            domain[rows[variable]] = row
@@ -1,125 +1,185 @@
 # Maxwell Carmichael 10/12/2020
 
 from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from BatchSolver import BatchSolver
+from ComponentSolver import ComponentSolver
 
 class MapColoringCSP:
-    def __init__(self, name, neighborgraph, MRV = True, DH = False, LCV = True, AC3 = True, print = False):
+        # options go to ConstraintSatisfactionProblem, e.g. backend = "bitset"
+        # components: color each connected part of the map (an island, say) on its
+        # own, with workers processes if given. the regions of any part which cannot
+        # be colored are listed in self.uncolorable
+    def __init__(self, name, neighborgraph, MRV = True, DH = False, LCV = True, AC3 = True, print = False, components = False, workers = None, **options):
         self.name = name
 
-        self.strmap = self.__strmap(neighborgraph) # int -> str
+        self.strmap = strmap(neighborgraph) # int -> str
         self.inverse_strmap = {value: key for key, value in self.strmap.items()} # str -> int
-        self.colormap = self.__colormap() # int -> str
-        self.neighbors = self.__neighborgraphToInt(neighborgraph)
+        self.colormap = colormap() # int -> str
+        self.neighbors = neighborgraphToInt(neighborgraph, self.inverse_strmap)
 
         # construct domain
-        domain = self.__domainmap()
+        domain = domainmap(self.neighbors, self.colormap)
         # construct constraints
-        constraints = self.__constraintmap()
+        constraints = constraintmap(self.neighbors, self.colormap)
 
-        self.CSP = ConstraintSatisfactionProblem(self.neighbors, domain, constraints, MRV, DH, LCV, AC3, print)
+        # one problem for the whole map, or one for each part
+        if components:
+            self.CSP = None
+            self.components = ComponentSolver(self.neighbors, domain, constraints, MRV, DH, LCV, AC3, **options)
+        else:
+            self.CSP = ConstraintSatisfactionProblem(self.neighbors, domain, constraints, MRV, DH, LCV, AC3, print, **options)
+            self.components = None
+        self.workers = workers
+        self.uncolorable = [] # lists of regions
+        self.nodes_visited = 0
         self.solution = self.__find_solution()
 
     def __find_solution(self):
-        return self.CSP.get_assignment()
+        if self.components is None:
+            solution = self.CSP.get_assignment()
+            self.nodes_visited = self.CSP.nodes_visited
+            return solution
 
-    def __strmap(self, neighborgraph):
-        strset = list(neighborgraph.keys()) # list for replicability
-        # random.shuffle(strset)
-        # print(strset)
+        solution = self.components.get_assignment(self.workers)
+        self.nodes_visited = self.components.nodes_visited
+        self.uncolorable = [[self.strmap[variable] for variable in part] for part in self.components.unsatisfiable]
+        return solution
 
-        strmap = {key: strset.pop() for key in range(0, len(strset), 1)}
-        # print(strmap)
+    def __str__(self):
+        # whichever searched: both have the flags and counters
+        solver = self.CSP if self.components is None else self.components
 
+        string = "----\n"
+        string += "Map Coloring CSP Problem: {:s}\n"
+        string += "Heuristics/Inference:  MRV: {:s}. DH: {:s} LCV: {:s}. AC3: {:s}\n"
 
-        return strmap
+        if self.solution:
+            string += "Number of recursion calls: {:d}\n"
+            string += "Solution: {:s}\n"
 
-    def __colormap(self, numcolors = 3):
-        colorset = [ "Blue", "Green", "Red"] # list for replicability
+            string = string.format(self.name, str(solver.MRV_FLAG), str(solver.DH_FLAG), str(solver.LCV_FLAG), str(solver.AC3_FLAG), self.nodes_visited, str(self.__solutionToStr()))
+        else:
+            string += "No solution found after {:d} recursion calls\n"
 
-        colormap = {key: colorset.pop() for key in range(0, len(colorset), 1)}
+            string = string.format(self.name, str(solver.MRV_FLAG), str(solver.DH_FLAG), str(solver.LCV_FLAG), str(solver.AC3_FLAG), self.nodes_visited)
 
-        # print(colormap)
-        return colormap
+            for regions in self.uncolorable:
+                string += "Cannot be colored: {:s}\n".format(", ".join(regions))
 
-    def __neighborgraphToInt(self, neighborgraph):
-        neighbors = {}
+        if solver.CBJ_FLAG:
+            string += "Backjumps: {:d}. Nogoods learned: {:d}. Nogood prunings: {:d}\n".format(solver.backjumps, solver.nogoods_learned, solver.nogood_prunings)
 
-        for variable in neighborgraph:
-            vneighbors = neighborgraph[variable]
+        return string
 
-            # if there is an error, it will be here. ensure the neighbor graph is valid.
-            intneighbors = set()
-            for neighbor in vneighbors:
-                if neighbor in self.inverse_strmap:
-                    intneighbors.add(self.inverse_strmap[neighbor])
-                else:
-                    print("Error with neighbors of " + variable)
-                    intneighbors.add(self.inverse_strmap[neighbor])
+        # returns a dictionary
+    def __solutionToStr(self):
+        coloredInMap = {}
 
-            # { self.inverse_strmap[neighbor] for neighbor in vneighbors }
+        # i reverse the map to match the input format
+        for i in range(len(self.solution)-1, -1, -1):
+            coloredInMap[self.strmap[i]] = self.colormap[self.solution[i]]
 
+        return coloredInMap
 
-            neighbors[self.inverse_strmap[variable]] = intneighbors
+# the structure of a map only depends on its neighbor graph, so it is built by
+# these functions, which MapColoringBatch shares between instances
 
-        # print(neighbors)
-        return neighbors
+def strmap(neighborgraph):
+    strset = list(neighborgraph.keys()) # list for replicability
+    # random.shuffle(strset)
+    # print(strset)
 
+    strmap = {key: strset.pop() for key in range(0, len(strset), 1)}
+    # print(strmap)
 
-    def __domainmap(self):
-        domain = {}
 
-        for variable in self.neighbors:
-            domain[variable] = set(self.colormap.keys())
+    return strmap
 
+def colormap(numcolors = 3):
+    colorset = [ "Blue", "Green", "Red"] # list for replicability
 
-        # print(domain)
-        return domain
+    colormap = {key: colorset.pop() for key in range(0, len(colorset), 1)}
 
-    def __constraintmap(self):
-        colorsneq = set()
+    # print(colormap)
+    return colormap
 
-        # each relation has the same constraint
-        for color1 in self.colormap:
-            for color2 in self.colormap:
-                if color1 != color2:
-                    colorsneq.add((color1, color2))
+def neighborgraphToInt(neighborgraph, inverse_strmap):
+    neighbors = {}
 
-        constraints = {}
-        for i in range(0, len(self.neighbors), 1):
-            for j in self.neighbors[i]:
-                # neighbors is undirected, so don't add duplicate constraints
-                if i < j:
-                    constraints[(i,j)] = colorsneq.copy()
+    for variable in neighborgraph:
+        vneighbors = neighborgraph[variable]
 
-        # print(constraints)
-        return constraints
+        # if there is an error, it will be here. ensure the neighbor graph is valid.
+        intneighbors = set()
+        for neighbor in vneighbors:
+            if neighbor in inverse_strmap:
+                intneighbors.add(inverse_strmap[neighbor])
+            else:
+                print("Error with neighbors of " + variable)
+                intneighbors.add(inverse_strmap[neighbor])
 
-    def __str__(self):
-        string = "----\n"
-        string += "Map Coloring CSP Problem: {:s}\n"
-        string += "Heuristics/Inference:  MRV: {:s}. DH: {:s} LCV: {:s}. AC3: {:s}\n"
+        # { inverse_strmap[neighbor] for neighbor in vneighbors }
 
-        if self.solution:
-            string += "Number of recursion calls: {:d}\n"
-            string += "Solution: {:s}\n"
 
-            string = string.format(self.name, str(self.CSP.MRV_FLAG), str(self.CSP.DH_FLAG), str(self.CSP.LCV_FLAG), str(self.CSP.AC3_FLAG), self.CSP.nodes_visited, str(self.__solutionToStr()))
-        else:
-            string += "No solution found after {:d} recursion calls\n"
+        neighbors[inverse_strmap[variable]] = intneighbors
 
-            string = string.format(self.name, str(self.CSP.MRV_FLAG), str(self.CSP.DH_FLAG), str(self.CSP.LCV_FLAG), str(self.CSP.AC3_FLAG), self.CSP.nodes_visited)
+    # print(neighbors)
+    return neighbors
 
-        return string
 
-        # returns a dictionary
-    def __solutionToStr(self):
-        coloredInMap = {}
+def domainmap(neighbors, colormap):
+    domain = {}
 
-        # i reverse the map to match the input format
-        for i in range(len(self.solution)-1, -1, -1):
-            coloredInMap[self.strmap[i]] = self.colormap[self.solution[i]]
+    for variable in neighbors:
+        domain[variable] = set(colormap.keys())
 
-        return coloredInMap
+
+    # print(domain)
+    return domain
+
+def constraintmap(neighbors, colormap):
+    colorsneq = set()
+
+    # each relation has the same constraint
+    for color1 in colormap:
+        for color2 in colormap:
+            if color1 != color2:
+                colorsneq.add((color1, color2))
+
+    constraints = {}
+    for i in range(0, len(neighbors), 1):
+        for j in neighbors[i]:
+            # neighbors is undirected, so don't add duplicate constraints
+            if i < j:
+                constraints[(i,j)] = colorsneq.copy()
+
+    # print(constraints)
+    return constraints
+
+# solves many instances of one map, which differ in the regions already colored:
+# each instance is a map (region -> color name), possibly empty, and each answer
+# a map (region -> color name) like MapColoringCSP's solution, or None. the
+# neighbors and constraints are built and compiled once.
+class MapColoringBatch(BatchSolver):
+    def __init__(self, neighborgraph, MRV = True, DH = False, LCV = True, AC3 = True, **options):
+        self.strmap = strmap(neighborgraph) # int -> str
+        self.inverse_strmap = {value: key for key, value in self.strmap.items()} # str -> int
+        self.colormap = colormap() # int -> str
+        self.inverse_colormap = {value: key for key, value in self.colormap.items()} # str -> int
+        neighbors = neighborgraphToInt(neighborgraph, self.inverse_strmap)
+
+        BatchSolver.__init__(self, neighbors, domainmap(neighbors, self.colormap), constraintmap(neighbors, self.colormap), MRV, DH, LCV, AC3, **options)
+
+    def instance(self, colored):
+        domain = {variable: set(self.colormap.keys()) for variable in self.strmap}
+
+        for region, color in colored.items():
+            domain[self.inverse_strmap[region]] = { self.inverse_colormap[color] }
+
+        return domain
+
+    def answer(self, assignment):
+        return {self.strmap[i]: self.colormap[assignment[i]] for i in range(len(assignment) - 1, -1, -1)}
 
 def test1():
     neighborhood = { "VT" : {"NH"}, "NH" : {"VT", "ME"}, "ME" : {"NH"} }
@@ -141,6 +201,19 @@ def test3():
     print("")
     print("solving...")
     print(p)
+# australia, tasmania colored on its own, and then an island no three colors can do
+def test4():
+    neighborhood = { "WA" : {"NT", "SA"}, "NT" : {"WA", "SA", "Q"}, "SA" : {"WA", "NT", "Q", "NSW", "V"}, "Q" : {"NT", "SA", "NSW"}, "NSW" : {"Q", "SA", "V"}, "V" : {"SA", "NSW"}, "T" : {}}
+    p = MapColoringCSP("Australia", neighborhood, components = True)
+    print("")
+    print("solving...")
+    print(p)
+
+    neighborhood.update({ "A" : {"B", "C", "D"}, "B" : {"A", "C", "D"}, "C" : {"A", "B", "D"}, "D" : {"A", "B", "C"} })
+    p = MapColoringCSP("Australia and K4 island", neighborhood, components = True, workers = 2)
+    print("solving...")
+    print(p)
 #
 # test2()
-test3()
+if __name__ == "__main__":
+    test3()
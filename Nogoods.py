@@ -0,0 +1,45 @@
+from collections import OrderedDict
+
+# nogoods learned by conflict-directed backjumping: sets of (variable, value)
+# which can never all hold in a solution. only the max_size most recently used
+# are kept, and each is indexed by its (variable, value) pairs so that assigning
+# a value only looks at the nogoods it appears in.
+class NogoodStore:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.nogoods = OrderedDict() # frozenset of (variable, value) -> None, least recently used first
+        self.watching = {} # (variable, value) -> set of nogoods containing it
+
+    def __len__(self):
+        return len(self.nogoods)
+
+        # returns False if it was already known (or nothing can be stored)
+    def add(self, nogood):
+        nogood = frozenset(nogood)
+
+        if self.max_size <= 0 or nogood in self.nogoods:
+            return False
+
+        self.nogoods[nogood] = None
+        for pair in nogood:
+            self.watching.setdefault(pair, set()).add(nogood)
+
+        # forget the least recently used nogood
+        if len(self.nogoods) > self.max_size:
+            oldest, unused = self.nogoods.popitem(last = False)
+            for pair in oldest:
+                self.watching[pair].discard(oldest)
+
+        return True
+
+        # the nogoods in which variable = value appears
+    def containing(self, variable, value):
+        return self.watching.get((variable, value), ())
+
+        # marks a nogood as recently used
+    def used(self, nogood):
+        self.nogoods.move_to_end(nogood)
+
+    def clear(self):
+        self.nogoods.clear()
+        self.watching.clear()
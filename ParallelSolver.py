@@ -0,0 +1,231 @@
+from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from Constraints import RectNoOverlap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import multiprocessing
+import queue
+import time
+
+# solves one hard instance on several cores. the top of the search tree is split
+# into cubes: a cube is a partial assignment (tuple of (variable, value)) together
+# with the domain snapshot left after propagating it, and each cube is searched
+# on its own in a worker process. whenever the queue of cubes runs dry, busy
+# workers are asked to give away the untried values at the top of their stack as
+# new cubes, so no core sits idle while one cube holds most of the work.
+
+# the ConstraintSatisfactionProblem (with its compiled constraints) is built once
+# and handed to each worker when it starts. with fork it is simply inherited
+# copy-on-write, so only the cubes themselves are ever pickled.
+
+# what a worker process keeps between tasks
+_worker = {}
+
+# what the parallel search found, and how much work it took
+class ParallelResult:
+    def __init__(self, assignment, nodes_visited, cubes, elapsed):
+        self.assignment = assignment
+        self.nodes_visited = nodes_visited
+        self.cubes = cubes
+        self.elapsed = elapsed
+
+    def __str__(self):
+        string = "----\n"
+        string += "Cubes searched: {:d}\n"
+        string += "Nodes visited: {:d}. Time (s): {:.3f}\n"
+        string += "Solution: {:s}\n"
+
+        return string.format(self.cubes, self.nodes_visited, self.elapsed, str(self.assignment))
+
+# processes started with fork share whatever the parent built, copy-on-write,
+# instead of having it pickled. where fork is not available, the default is used.
+def fork_context():
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+
+    return multiprocessing.get_context()
+
+def init_worker(csp, cancel, hungry, donations):
+    # a donated cube nobody reads any more (after a solution) must not keep the worker alive
+    donations.cancel_join_thread()
+
+    _worker["csp"] = csp
+    _worker["cancel"] = cancel
+    _worker["hungry"] = hungry
+    _worker["donations"] = donations
+
+# one cube for each value of variable which survives propagation. the domain must
+# be in the state where decisions have been made and variable has not.
+def make_cubes(csp, decisions, variable, values):
+    cubes = []
+
+    for value in values:
+        mark = csp.domain.mark()
+        csp.forward_check(variable, value)
+
+        if not csp.AC3_FLAG or csp.inference(mark):
+            cubes.append((decisions + ((variable, value),), csp.domain.snapshot(trail = False)))
+
+        csp.domain.undo(mark)
+
+    return cubes
+
+# the cubes one level below cube (the root if None). the first return value is a
+# solution, if the search already ends at cube.
+def expand(csp, cube):
+    csp.start_search(cube)
+
+    if csp.finished:
+        return csp.result, [], csp.nodes_visited
+
+    decisions = () if cube is None else cube[0]
+    variable, values, index, mark = csp.stack[0][:4]
+
+    return None, make_cubes(csp, decisions, variable, values), csp.nodes_visited
+
+# splits the top max_depth levels of the tree, breadth first, until there are at
+# least target cubes
+def initial_cubes(csp, target, max_depth):
+    solution, cubes, nodes = expand(csp, None)
+
+    for depth in range(1, max_depth, 1):
+        if solution is not None or len(cubes) >= target:
+            break
+
+        next_cubes = []
+        for cube in cubes:
+            solution, below, visited = expand(csp, cube)
+            nodes += visited
+            if solution is not None:
+                break
+            next_cubes.extend(below)
+        cubes = next_cubes
+
+    return solution, cubes, nodes
+
+# gives away the untried values of the shallowest choice point which has any, as
+# cubes, and drops them from this search. decisions: the cube being searched.
+def donate(csp, decisions):
+    path = decisions
+
+    for depth, frame in enumerate(csp.stack):
+        variable, values, index, mark = frame[:4]
+
+        if index < len(values):
+            # go back up to that choice point to propagate its other values, then
+            # come back down to where the search was
+            checkpoint = csp.checkpoint()
+            csp.domain.undo(mark)
+            cubes = make_cubes(csp, path, variable, values[index:])
+            csp.restore(checkpoint)
+
+            csp.stack[depth][1] = values[:index]
+            return cubes
+
+        # only the top choice point can have no values at all
+        if not values:
+            break
+
+        path = path + ((variable, values[index - 1]),)
+
+    return []
+
+# searches one cube in a worker process, check_every nodes at a time, in between
+# stopping if another cube was solved and donating work if the queue is empty.
+# with restarts, nothing is donated: a restart starts the cube over with all of
+# its values, so it would search the subtrees given away a second time
+def run_cube(cube, check_every):
+    csp = _worker["csp"]
+    donated = 0
+
+    csp.start_search(cube)
+
+    while not csp.resume(check_every):
+        if _worker["cancel"].is_set():
+            return None, csp.nodes_visited, donated
+
+        if _worker["hungry"].is_set() and csp.restart_schedule is None:
+            cubes = donate(csp, cube[0])
+            if cubes:
+                _worker["donations"].put(cubes)
+                donated += 1
+
+    return csp.result, csp.nodes_visited, donated
+
+# options go to ConstraintSatisfactionProblem. the backend = "bitset" store makes
+# for the smallest cubes. returns a ParallelResult, whose assignment is None if
+# there is no solution. constraints only need to be picklable where fork is not
+# available (see PortfolioSolver).
+def solve_parallel(neighbors, domain, constraints, max_workers = None, cubes_per_worker = 4, max_depth = 4, check_every = 200, **options):
+    t = time.time()
+    workers = max_workers or multiprocessing.cpu_count()
+
+    csp = ConstraintSatisfactionProblem(neighbors, domain, constraints, print = False, **options)
+    solution, cubes, nodes = initial_cubes(csp, workers * cubes_per_worker, max_depth)
+
+    if solution is not None or not cubes:
+        return ParallelResult(solution, nodes, 0, time.time() - t)
+
+    context = fork_context()
+    cancel = context.Event()
+    hungry = context.Event() # set while there is no cube waiting to be searched
+    donations = context.Queue() # lists of cubes given away by workers
+
+    executor = ProcessPoolExecutor(max_workers = workers, mp_context = context, initializer = init_worker, initargs = (csp, cancel, hungry, donations))
+    pending = deque(cubes) # searched in the order the sequential search would take them
+    running = set()
+    searched = 0
+    donated = 0 # batches of cubes workers have reported giving away
+    received = 0
+
+    try:
+        while True:
+            while pending and len(running) < workers:
+                running.add(executor.submit(run_cube, pending.popleft(), check_every))
+
+            while True:
+                try:
+                    pending.extend(donations.get_nowait())
+                    received += 1
+                except queue.Empty:
+                    break
+
+            if pending:
+                hungry.clear()
+            else:
+                hungry.set()
+
+            # nothing left to search, and no donation still on its way
+            if not running and not pending and received == donated:
+                return ParallelResult(None, nodes, searched, time.time() - t)
+
+            done, running = wait(running, timeout = 0.01, return_when = FIRST_COMPLETED)
+
+            for future in done:
+                assignment, visited, batches = future.result()
+                nodes += visited
+                donated += batches
+                searched += 1
+
+                if assignment is not None:
+                    return ParallelResult(assignment, nodes, searched, time.time() - t)
+    finally:
+        cancel.set()
+        executor.shutdown(wait = True, cancel_futures = True)
+        donations.close()
+
+
+# the 15x11 board from CircuitBoardCSP.test4
+def test1():
+    piecemap = { 'a' : (3,6), 'b' : (1,5), 'd' : (3,11), 'e' : (2,5), 'h' : (3,5), 'i' : (1,10), 'j' : (6,6), 'k' : (2,4), 'l' : (1,1), 'm' : (5,4), 'n' : (5,1), 'o' : (1,1), 'p' : (3,1)}
+    n = 15
+    m = 11
+    sizes = list(piecemap.values())
+
+    neighbors = { i : set(range(0, len(sizes), 1)) - { i } for i in range(0, len(sizes), 1) }
+    domain = { i : { (x, y) for x in range(0, n - sizes[i][0] + 1, 1) for y in range(0, m - sizes[i][1] + 1, 1) } for i in neighbors }
+    constraints = { (i, j) : RectNoOverlap(sizes[i], sizes[j]) for i in neighbors for j in neighbors if i < j }
+
+    print(solve_parallel(neighbors, domain, constraints, MRV = True, LCV = False, AC3 = False, backend = "bitset"))
+
+if __name__ == "__main__":
+    test1()
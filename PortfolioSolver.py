@@ -0,0 +1,116 @@
+from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import multiprocessing
+import time
+
+# which heuristics pay off changes a lot from one instance to the next, so the
+# portfolio runs several ConstraintSatisfactionProblem configurations at once in
+# separate processes and keeps whichever finishes first. each configuration is a
+# map of keyword arguments for ConstraintSatisfactionProblem.
+DEFAULT_CONFIGS = [
+    { "MRV" : True, "DH" : False, "LCV" : False, "AC3" : True, "MAC" : True, "AC3rm" : True },
+    { "MRV" : True, "DH" : True, "LCV" : False, "AC3" : True, "MAC" : True, "AC3rm" : True },
+    { "MRV" : True, "DH" : False, "LCV" : True, "AC3" : True, "MAC" : True },
+    { "MRV" : True, "DH" : False, "LCV" : False, "AC3" : False },
+    { "MRV" : False, "DH" : False, "LCV" : False, "AC3" : True, "MAC" : True, "AC3rm" : True },
+]
+
+# what the portfolio found, and which configuration (and seed) found it
+class PortfolioResult:
+    def __init__(self, assignment, config, nodes_visited, elapsed):
+        self.assignment = assignment
+        self.config = config
+        self.nodes_visited = nodes_visited
+        self.elapsed = elapsed
+
+    def __str__(self):
+        string = "----\n"
+        string += "Portfolio winner: {:s}\n"
+        string += "Nodes visited: {:d}. Time (s): {:.3f}\n"
+        string += "Solution: {:s}\n"
+
+        return string.format(str(self.config), self.nodes_visited, self.elapsed, str(self.assignment))
+
+# runs one configuration in a worker process. the search is resumed check_every
+# nodes at a time, so the worker notices quickly when another one has won.
+def run_config(neighbors, domain, constraints, config, cancel, check_every):
+    csp = ConstraintSatisfactionProblem(neighbors, domain, constraints, print = False, **config)
+    csp.start_search()
+
+    while not csp.resume(check_every):
+        if cancel.is_set():
+            return config, False, None, csp.nodes_visited
+
+    return config, True, csp.result, csp.nodes_visited
+
+# whether a seed changes the search of config: only MRV ties are broken at random,
+# and not when DH or a variable key (WDEG, ACTIVITY) breaks them instead
+def seeded(config):
+    return config.get("MRV", True) and not config.get("DH", False) and not config.get("WDEG", False) and not config.get("ACTIVITY", False)
+
+# solves one instance with every configuration, each once per seed (None keeps the
+# usual tie-breaking, an int breaks MRV ties at random). a configuration which a
+# seed cannot change (see seeded) only runs with the first seed. the first configuration
+# to finish wins; it either has a solution, or it has proven there is none, in
+# which case the assignment is None. the rest are cancelled.
+# the domain and constraints are pickled for each worker, so constraints have to
+# be picklable (sets and the built-ins are; lambdas are not).
+def solve_portfolio(neighbors, domain, constraints, configs = None, seeds = (None,), max_workers = None, check_every = 500):
+    if configs is None:
+        configs = DEFAULT_CONFIGS
+
+    seeds = list(seeds)
+    if not configs or not seeds:
+        raise ValueError("no configurations to run")
+
+    runs = []
+    for config in configs:
+        # other seeds would only repeat the same search
+        for seed in (seeds if seeded(config) else seeds[:1]):
+            run = dict(config)
+            if seed is not None:
+                run["seed"] = seed
+            runs.append(run)
+
+    t = time.time()
+    manager = multiprocessing.Manager()
+    cancel = manager.Event()
+    executor = ProcessPoolExecutor(max_workers = max_workers or min(len(runs), multiprocessing.cpu_count()))
+
+    try:
+        pending = {executor.submit(run_config, neighbors, domain, constraints, run, cancel, check_every) for run in runs}
+        error = None
+
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+
+            for future in done:
+                # a configuration which crashes should not sink the others
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+
+                config, finished, assignment, nodes_visited = future.result()
+                if finished:
+                    return PortfolioResult(assignment, config, nodes_visited, time.time() - t)
+
+        raise error
+    finally:
+        cancel.set()
+        executor.shutdown(wait = True, cancel_futures = True)
+        manager.shutdown()
+
+
+# australia, as in ConstraintSatisfactionProblem.test2
+def test1():
+    neighbors = { 0 : {1, 2}, 1 : {0, 2, 3}, 2 : {0, 1, 3, 4, 5}, 3 : {1, 2, 4},
+                    4 : {2, 3, 5}, 5 : {2, 4}, 6 : set()}
+    colors = { 0, 1, 2 }
+    domain = { variable : colors.copy() for variable in neighbors }
+    colorsneq = { (0,1), (0,2), (1,0), (1,2), (2,0), (2,1) }
+    constraints = { (0,1) : set(colorsneq), (0,2) : set(colorsneq), (1,2) : set(colorsneq), (1,3) : set(colorsneq), (2,3) : set(colorsneq), (2,4) : set(colorsneq), (2,5) : set(colorsneq), (3,4) : set(colorsneq), (4,5) : set(colorsneq) }
+
+    print(solve_portfolio(neighbors, domain, constraints, seeds = (None, 1, 2)))
+
+if __name__ == "__main__":
+    test1()
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import SudokuCSP
+import hashlib
+import json
+import sqlite3
+
+# remembers the answers of SolverService requests. requests are first put in a
+# canonical form, so that the same problem is recognized however it is written:
+# regions and pieces are sorted, pieces are known by their size alone (their
+# letters do not matter), and a sudoku's digits are renumbered in the order they
+# first appear. answers are stored in canonical terms and translated back into
+# each caller's own labels.
+
+# a request in canonical form: key (a content hash), plus encode and decode,
+# which take a solution from the request's terms to canonical ones and back
+class Canonical:
+    def __init__(self, form, encode, decode):
+        self.key = hashlib.sha256(json.dumps(form, sort_keys = True).encode()).hexdigest()
+        self.encode = encode
+        self.decode = decode
+
+# the canonical form of a request, or None for a kind it does not know. raises
+# TypeError or ValueError (or similar) for a badly formed request
+def canonicalize(request):
+    kind = request.get("kind")
+
+    if kind == "sudoku":
+        return canonical_sudoku(request["board"])
+    if kind == "map":
+        return canonical_map(request["neighbors"])
+    if kind == "circuit":
+        return canonical_circuit(request["pieces"], request["n"], request["m"])
+
+    return None
+
+# digits are renumbered 1, 2, ... in the order they first appear, row by row,
+# then the digits which are not given, in order. any solution stays a solution
+# under such a renumbering
+def canonical_sudoku(board):
+    if isinstance(board, str):
+        board = SudokuCSP.parseBoard(board)
+
+    n = len(board)
+    order = []
+    for row in board:
+        for digit in row:
+            if digit != 0 and digit not in order:
+                order.append(digit)
+    order += [digit for digit in range(1, n + 1, 1) if digit not in order]
+
+    to_canonical = {digit: i + 1 for i, digit in enumerate(order)}
+    from_canonical = {i + 1: digit for i, digit in enumerate(order)}
+
+    form = ["sudoku", [[to_canonical[digit] if digit != 0 else 0 for digit in row] for row in board]]
+    encode = lambda rows: [[to_canonical[digit] for digit in row] for row in rows]
+    decode = lambda rows: [[from_canonical[digit] for digit in row] for row in rows]
+
+    return Canonical(form, encode, decode)
+
+# regions sorted, each with its sorted neighbors. colors are the solver's own
+def canonical_map(graph):
+    form = ["map", sorted([region, sorted(set(graph[region]))] for region in graph)]
+    encode = lambda coloring: [coloring[region] for region in sorted(graph)]
+    decode = lambda colors: dict(zip(sorted(graph), colors))
+
+    return Canonical(form, encode, decode)
+
+# pieces sorted by size, so two pieces of the same size are interchangeable,
+# whatever their letters
+def canonical_circuit(pieces, n, m):
+    labels = sorted(pieces, key = lambda char: (list(pieces[char]), char))
+
+    form = ["circuit", n, m, [list(pieces[char]) for char in labels]]
+    encode = lambda placed: [list(placed[char]) for char in labels]
+    decode = lambda positions: {char: list(position) for char, position in zip(labels, positions)}
+
+    return Canonical(form, encode, decode)
+
+# canonical key -> answer (plain json values), the max_entries most recently
+# used kept in memory. with path, every answer is also written to an sqlite
+# database there, which outlives the process and is read on a miss in memory
+class ResultCache:
+    def __init__(self, max_entries = 1024, path = None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, answer TEXT)")
+            self.db.commit()
+
+    def __len__(self):
+        return len(self.entries)
+
+        # the answer stored under key, or None
+    def get(self, key):
+        answer = self.entries.get(key)
+
+        if answer is not None:
+            self.entries.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute("SELECT answer FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                answer = json.loads(row[0])
+                self.__remember(key, answer)
+
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return answer
+
+    def put(self, key, answer):
+        self.__remember(key, answer)
+
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO results (key, answer) VALUES (?, ?)", (key, json.dumps(answer)))
+            self.db.commit()
+
+    def __remember(self, key, answer):
+        self.entries[key] = answer
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,344 @@
+from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from Constraints import RectTables
+from ParallelSolver import fork_context
+from ResultCache import ResultCache, canonicalize
+from Stats import SAT, UNSAT, TIMEOUT
+import CircuitBoardCSP
+import MapColoringCSP
+import SudokuCSP
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+# solves sudokus, maps and circuit boards for an asyncio program without blocking
+# its event loop. a request is a dict (parsed from json), e.g.
+#   {"kind": "sudoku", "board": "53..7....6..195...", "timeout": 2}
+#   {"kind": "map", "neighbors": {"WA": ["NT", "SA"], ...}, "options": {"MAC": true}}
+#   {"kind": "circuit", "pieces": {"a": [3, 2], "b": [5, 2]}, "n": 10, "m": 3}
+# and the answer a dict with the status, the solution in the request's own terms
+# (rows of a board, region -> color, piece -> [x, y]), nodes and seconds.
+#
+# without workers, a search runs in the event loop itself, slice_nodes nodes at a
+# time, and lets other tasks run in between. with workers, searches go to a pool
+# of that many processes, with at most queue_size more requests waiting (more are
+# turned away as busy). either way, a request identical to one still being solved
+# waits for that one's answer instead of being solved twice.
+#
+# with a cache (see ResultCache), a request for a problem solved before, even
+# with other letters for its pieces or other digits on its board, is answered
+# from there (with "cached": true) without a search. only SAT and UNSAT answers
+# are cached, as a timeout says nothing about the problem itself.
+#
+# python SolverService.py --stdio reads one request per line on stdin and writes
+# one answer per line (with the request's "id") as each finishes.
+# python SolverService.py --http 8080 answers POST /solve, and GET /stats.
+
+# ConstraintSatisfactionProblem arguments a request may set in "options"
+OPTIONS = {"MRV", "DH", "LCV", "AC3", "MAC", "AC3rm", "CBJ", "WDEG", "ACTIVITY", "backend", "seed", "restarts", "restart_base"}
+
+class RequestError(Exception):
+    pass
+
+# ---- from requests to problems and back
+
+# the problem a request describes: (neighbors, domain, constraints, answer), where
+# answer converts a solution into the request's terms
+def build(request):
+    kind = request.get("kind")
+
+    if kind == "sudoku":
+        board = request.get("board")
+        try:
+            if isinstance(board, str):
+                board = SudokuCSP.parseBoard(board)
+            SudokuCSP.checkBoard(board)
+        except (TypeError, ValueError) as error:
+            raise RequestError(str(error))
+
+        n = len(board)
+        answer = lambda assignment: [assignment[y*n:(y + 1)*n] for y in range(0, n, 1)]
+        return SudokuCSP.genNeighbors(n), SudokuCSP.domainmap(board), SudokuCSP.constraintmap(n), answer
+
+    if kind == "map":
+        graph = request.get("neighbors")
+        if not isinstance(graph, dict) or any(other not in graph for regions in graph.values() for other in regions):
+            raise RequestError("neighbors must map each region to a list of regions")
+
+        strmap = MapColoringCSP.strmap(graph)
+        colormap = MapColoringCSP.colormap()
+        neighbors = MapColoringCSP.neighborgraphToInt(graph, {value: key for key, value in strmap.items()})
+
+        answer = lambda assignment: {strmap[i]: colormap[assignment[i]] for i in range(len(assignment) - 1, -1, -1)}
+        return neighbors, MapColoringCSP.domainmap(neighbors, colormap), MapColoringCSP.constraintmap(neighbors, colormap), answer
+
+    if kind == "circuit":
+        pieces = request.get("pieces")
+        n = request.get("n")
+        m = request.get("m")
+        if not isinstance(pieces, dict) or not isinstance(n, int) or not isinstance(m, int):
+            raise RequestError("a circuit needs pieces (char -> [width, height]), n and m")
+
+        piecemap = {char: tuple(size) for char, size in pieces.items()}
+        charmap = CircuitBoardCSP.charmap(piecemap)
+        neighbors = CircuitBoardCSP.genCompleteGraph(charmap)
+
+        answer = lambda assignment: {charmap[i]: list(assignment[i]) for i in range(len(assignment) - 1, -1, -1)}
+        return neighbors, CircuitBoardCSP.domainmap(neighbors, charmap, piecemap, n, m), CircuitBoardCSP.constraintmap(neighbors, charmap, piecemap, tables = RectTables(n, m)), answer
+
+    raise RequestError("kind must be sudoku, map or circuit")
+
+def make_problem(request):
+    options = request.get("options", {})
+    if not isinstance(options, dict) or not set(options) <= OPTIONS:
+        raise RequestError("options must be a dict of " + ", ".join(sorted(OPTIONS)))
+    # a request without a timeout must not be able to restart forever
+    if "restart_base" in options and (not isinstance(options["restart_base"], int) or options["restart_base"] < 1):
+        raise RequestError("restart_base must be a whole number of nodes, at least 1")
+
+    neighbors, domain, constraints, answer = build(request)
+    return ConstraintSatisfactionProblem(neighbors, domain, constraints, print = False, **options), answer
+
+# identical requests (apart from their id) have the same key
+def request_key(request):
+    return json.dumps({key: value for key, value in request.items() if key != "id"}, sort_keys = True)
+
+def reply(status, csp, answer, elapsed):
+    return {
+        "status" : status,
+        "solution" : None if csp.result is None else answer(csp.result),
+        "nodes" : csp.nodes_visited,
+        "seconds" : round(elapsed, 6),
+    }
+
+# solves a request in one go (in a worker process), within its limits
+def solve_request(request):
+    t = time.perf_counter()
+    csp, answer = make_problem(request)
+    result = csp.solve(request.get("max_nodes"), request.get("timeout"))
+
+    return reply(result.status, csp, answer, time.perf_counter() - t)
+
+# ---- the service
+
+class SolverService:
+        # workers: size of the process pool, or None to search in the event loop
+        # cache: a ResultCache, or None
+    def __init__(self, workers = None, queue_size = 64, slice_nodes = 200, cache = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.slice_nodes = slice_nodes
+        self.cache = cache
+
+        self.in_flight = {} # request key -> task solving it
+        self.waiting = 0 # requests waiting for a worker
+        self.counts = {"requests" : 0, "deduplicated" : 0, "cached" : 0, "busy" : 0, "errors" : 0}
+
+        self.executor = None
+        self.slots = None
+        if workers:
+            self.executor = ProcessPoolExecutor(max_workers = workers, mp_context = fork_context())
+            self.slots = asyncio.Semaphore(workers)
+
+        # the answer to a request. the request's "id", if any, is copied into it
+    async def solve(self, request):
+        self.counts["requests"] += 1
+
+        try:
+            key = request_key(request)
+        except (TypeError, ValueError, AttributeError):
+            key = None
+
+        if key is None:
+            answer = {"error" : "a request must be a json object"}
+        else:
+            task = self.in_flight.get(key)
+
+            if task is None:
+                task = asyncio.ensure_future(self.__solve(request))
+                self.in_flight[key] = task
+                task.add_done_callback(lambda done: self.in_flight.pop(key, None))
+            else:
+                self.counts["deduplicated"] += 1
+
+            # one caller giving up must not cancel the others' search
+            answer = dict(await asyncio.shield(task))
+
+        if "error" in answer:
+            self.counts["errors"] += 1
+        if isinstance(request, dict) and "id" in request:
+            answer["id"] = request["id"]
+
+        return answer
+
+    async def __solve(self, request):
+        canonical = None
+        if self.cache is not None:
+            try:
+                canonical = canonicalize(request)
+            except (TypeError, ValueError, KeyError, IndexError, AttributeError):
+                canonical = None # a bad request, which solving reports properly
+
+        if canonical is not None:
+            cached = self.cache.get(canonical.key)
+            if cached is not None:
+                self.counts["cached"] += 1
+                return {"status" : cached["status"], "solution" : None if cached["solution"] is None else canonical.decode(cached["solution"]), "nodes" : 0, "seconds" : 0.0, "cached" : True}
+
+        try:
+            if self.executor is None:
+                answer = await self.__solve_sliced(request)
+            else:
+                answer = await self.__solve_pooled(request)
+        except RequestError as error:
+            return {"error" : str(error)}
+        except (TypeError, ValueError, KeyError, IndexError) as error:
+            return {"error" : "bad request: " + str(error)}
+
+        if canonical is not None and answer.get("status") in (SAT, UNSAT):
+            self.cache.put(canonical.key, {"status" : answer["status"], "solution" : None if answer["solution"] is None else canonical.encode(answer["solution"])})
+
+        return answer
+
+        # searches in the event loop, slice_nodes nodes at a time
+    async def __solve_sliced(self, request):
+        t = time.perf_counter()
+        csp, answer = make_problem(request)
+
+        max_nodes = request.get("max_nodes")
+        timeout = request.get("timeout")
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        csp.start_search()
+        while not csp.finished:
+            if (deadline is not None and time.monotonic() >= deadline) or (max_nodes is not None and csp.nodes_visited >= max_nodes):
+                return reply(TIMEOUT, csp, answer, time.perf_counter() - t)
+
+            await asyncio.sleep(0)
+            csp.resume(self.slice_nodes if max_nodes is None else min(self.slice_nodes, max_nodes - csp.nodes_visited))
+
+        return reply(SAT if csp.result is not None else UNSAT, csp, answer, time.perf_counter() - t)
+
+        # hands the search to the pool once a worker is free
+    async def __solve_pooled(self, request):
+        if self.waiting >= self.queue_size:
+            self.counts["busy"] += 1
+            return {"error" : "busy"}
+
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, solve_request, request)
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        return dict(self.counts, in_flight = len(self.in_flight), waiting = self.waiting)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = True, cancel_futures = True)
+        if self.cache is not None:
+            self.cache.close()
+
+# ---- front ends
+
+# one request per line in, one answer per line out, in the order they finish
+async def serve_stdio(service):
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def answer(line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = None
+
+        response = await service.solve(request)
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        if line.strip():
+            task = asyncio.ensure_future(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+
+# a bare HTTP/1.1 server: POST /solve with a json request, GET /stats
+async def serve_http(service, host, port):
+    async def handle(reader, writer):
+        try:
+            method, path, version = (await reader.readline()).decode("latin-1").split()
+            length = 0
+
+            while True:
+                header = (await reader.readline()).decode("latin-1").strip()
+                if not header:
+                    break
+                name, _, value = header.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+
+            body = await reader.readexactly(length)
+
+            if method == "POST" and path == "/solve":
+                try:
+                    request = json.loads(body)
+                except ValueError:
+                    request = None
+                status, response = "200 OK", await service.solve(request)
+            elif method == "GET" and path == "/stats":
+                status, response = "200 OK", service.stats()
+            else:
+                status, response = "404 Not Found", {"error" : "POST /solve or GET /stats"}
+        except (ValueError, asyncio.IncompleteReadError):
+            status, response = "400 Bad Request", {"error" : "bad request"}
+
+        data = json.dumps(response).encode()
+        writer.write(("HTTP/1.1 " + status + "\r\nContent-Type: application/json\r\nContent-Length: " + str(len(data)) + "\r\nConnection: close\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+async def main(options):
+    cache = None
+    if options.cache_size or options.cache_db:
+        cache = ResultCache(options.cache_size or 1024, options.cache_db)
+
+    service = SolverService(options.workers, options.queue_size, options.slice_nodes, cache)
+
+    try:
+        if options.http is not None:
+            await serve_http(service, options.host, options.http)
+        else:
+            await serve_stdio(service)
+    finally:
+        service.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serves sudoku, map coloring and circuit board requests as json.")
+    parser.add_argument("--stdio", action = "store_true", help = "json lines on stdin and stdout (the default)")
+    parser.add_argument("--http", type = int, metavar = "PORT", help = "serve HTTP on this port instead")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--workers", type = int, help = "search in a pool of this many processes")
+    parser.add_argument("--queue-size", type = int, default = 64, help = "requests which may wait for a worker")
+    parser.add_argument("--slice-nodes", type = int, default = 200, help = "nodes searched between yields, without workers")
+    parser.add_argument("--cache-size", type = int, default = 0, help = "answers kept in memory (0: no cache, unless --cache-db)")
+    parser.add_argument("--cache-db", help = "sqlite file which keeps every answer across runs")
+
+    asyncio.run(main(parser.parse_args()))
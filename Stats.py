@@ -0,0 +1,58 @@
+# what one search of ConstraintSatisfactionProblem took, from its stats() method.
+# the counters are kept as plain attributes of the problem while it searches (an
+# integer increment each), and only gathered here once someone asks for them.
+class SearchStats:
+    def __init__(self, csp):
+        self.nodes = csp.nodes_visited
+        self.backtracks = csp.backtracks
+        self.propagations = csp.propagations
+        self.max_depth = csp.max_depth
+        self.pruned = dict(csp.pruned) # kind of propagator -> values pruned, with profile
+        self.times = dict(csp.times) # phase ("setup", "root", "search") -> seconds
+        self.backjumps = csp.backjumps
+        self.nogoods_learned = csp.nogoods_learned
+        self.nogood_prunings = csp.nogood_prunings
+        self.restarts = csp.restarts_done
+
+        # plain types only, e.g. for json
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        string = "Nodes: {:d}. Backtracks: {:d}. Propagations: {:d}. Max depth: {:d}\n".format(self.nodes, self.backtracks, self.propagations, self.max_depth)
+        string += "Time (s): setup {:.4f}, root {:.4f}, search {:.4f}\n".format(self.times["setup"], self.times["root"], self.times["search"])
+
+        if self.backjumps or self.nogoods_learned or self.restarts:
+            string += "Backjumps: {:d}. Nogoods learned: {:d}. Nogood prunings: {:d}. Restarts: {:d}\n".format(self.backjumps, self.nogoods_learned, self.nogood_prunings, self.restarts)
+
+        for kind, count in sorted(self.pruned.items()):
+            string += "Pruned by {:s}: {:d}\n".format(kind, count)
+
+        return string
+
+# the statuses of a SearchResult
+SAT = "SAT"
+UNSAT = "UNSAT"
+TIMEOUT = "TIMEOUT"
+CANCELLED = "CANCELLED"
+
+# what ConstraintSatisfactionProblem.solve found: the status, the solution (None
+# unless SAT), the most complete partial assignment it saw (the solution, if there
+# is one; unassigned variables are None), and the SearchStats
+class SearchResult:
+    def __init__(self, status, assignment, best, stats):
+        self.status = status
+        self.assignment = assignment
+        self.best = best
+        self.stats = stats
+
+    def __str__(self):
+        string = "----\n"
+        string += "Status: {:s}\n".format(self.status)
+
+        if self.assignment is not None:
+            string += "Solution: {:s}\n".format(str(self.assignment))
+        elif self.best is not None:
+            string += "Best partial assignment: {:s}\n".format(str(self.best))
+
+        return string + str(self.stats)
@@ -1,102 +1,32 @@
 # Maxwell Carmichael 10/17/2020
 
 from ConstraintSatisfactionProblem import ConstraintSatisfactionProblem
+from Constraints import AllDifferent
+from BatchSolver import BatchSolver
 import math
 
 class SudokuCSP:
         # len(board) must be a perfect square
-    def __init__(self, name, board, MRV = True, DH = False, LCV = True, AC3 = True, print = False):
+        # options go to ConstraintSatisfactionProblem, e.g. backend = "bitset"
+    def __init__(self, name, board, MRV = True, DH = False, LCV = True, AC3 = True, print = False, **options):
         self.name = name
 
         # self.strmap = self.__strmap(neighborgraph) # int -> str
         # self.inverse_strmap = {value: key for key, value in self.strmap.items()} # str -> int
         # self.colormap = self.__colormap() # int -> str
-        self.neighbors = self.__genNeighbors(board)
+        self.neighbors = genNeighbors(len(board))
 
         # construct domain
-        domain = self.__domainmap(board)
+        domain = domainmap(board)
         # construct constraints
-        constraints = self.__constraintmap(board)
+        constraints = constraintmap(len(board))
 
-        self.CSP = ConstraintSatisfactionProblem(self.neighbors, domain, constraints, MRV, DH, LCV, AC3, print)
+        self.CSP = ConstraintSatisfactionProblem(self.neighbors, domain, constraints, MRV, DH, LCV, AC3, print, **options)
         self.solution = self.__find_solution()
 
     def __find_solution(self):
-        print("starting testing")
         return self.CSP.get_assignment()
 
-        # each spot's neighbors are its column, row, and box
-    def __genNeighbors(self, board):
-        neighbormap = {}
-
-        n = len(board)
-        s = int(math.sqrt(len(board)))
-
-        for i in range(0, n, 1):
-            for j in range(0, n, 1):
-                neighbors = set()
-
-                boxi = i // s * s
-                boxj = j // s * s
-
-                # box
-                for x in range(boxi, boxi + s, 1):
-                    for y in range(boxj, boxj + s, 1):
-                        if x != i and y != j:
-                            neighbors.add(self.__coordToIndex(x, y, n))
-
-                # column
-                for y in range(0, n, 1):
-                    if y != j:
-                        neighbors.add(self.__coordToIndex(i, y, n))
-
-                # row
-                for x in range(0, n, 1):
-                    if x != i:
-                        neighbors.add(self.__coordToIndex(x, j, n))
-
-                neighbormap[self.__coordToIndex(i, j, n)] = neighbors
-
-        return neighbormap
-
-    def __coordToIndex(self, x, y, n):
-        return x + y*n
-
-    def __domainmap(self, board):
-        allnums = { 1,2,3,4,5,6,7,8,9 }
-        domain = {}
-
-        n = len(board)
-
-        for x in range(0, n, 1):
-            for y in range(0, n, 1):
-                # domain is all numbers
-                if board[y][x] == 0:
-                    domain[self.__coordToIndex(x, y, n)] = allnums.copy()
-                # domain is one number
-                else:
-                    domain[self.__coordToIndex(x, y, n)] = { board[y][x] }
-
-        return domain
-
-    def __constraintmap(self, board):
-        constraints = {}
-
-        # this will be the set of all possible combinations of numbers
-        numsneq = set()
-        for i in range(1, len(board) + 1, 1):
-            for j in range(1, len(board) + 1, 1):
-                if i != j:
-                    numsneq.add((i,j))
-
-        # neighbors will have this constraint
-        for variable in self.neighbors:
-            for neighbor in self.neighbors[variable]:
-                if variable < neighbor:
-                    constraints[(variable, neighbor)] = numsneq.copy()
-
-        return constraints
-
     def __str__(self):
         string = "----\n"
         string += "Map Coloring CSP Problem: {:s}\n"
@@ -106,12 +36,15 @@ class SudokuCSP:
             string += "Number of recursion calls: {:d}\n"
             string += "Solution: {:s}\n"
 
-            string = string.format(self.name, str(self.CSP.MRV_FLAG), str(self.CSP.DH_FLAG), str(self.CSP.LCV_FLAG), str(self.CSP.AC3_FLAG), str(self.__solutionToStr()))
+            string = string.format(self.name, str(self.CSP.MRV_FLAG), str(self.CSP.DH_FLAG), str(self.CSP.LCV_FLAG), str(self.CSP.AC3_FLAG), self.CSP.nodes_visited, str(self.__solutionToStr()))
         else:
             string += "No solution found after {:d} recursion calls\n"
 
             string = string.format(self.name, str(self.CSP.MRV_FLAG), str(self.CSP.DH_FLAG), str(self.CSP.LCV_FLAG), str(self.CSP.AC3_FLAG), self.CSP.nodes_visited)
 
+        if self.CSP.CBJ_FLAG:
+            string += "Backjumps: {:d}. Nogoods learned: {:d}. Nogood prunings: {:d}\n".format(self.CSP.backjumps, self.CSP.nogoods_learned, self.CSP.nogood_prunings)
+
         return string
 
     def __solutionToStr(self):
@@ -138,6 +71,140 @@ class SudokuCSP:
 
         return string
 
+# the structure of a sudoku only depends on its size n, so it is built by these
+# functions, which SudokuBatch shares between boards
+
+# each spot's neighbors are its column, row, and box
+def genNeighbors(n):
+    neighbormap = {}
+
+    s = int(math.sqrt(n))
+
+    for i in range(0, n, 1):
+        for j in range(0, n, 1):
+            neighbors = set()
+
+            boxi = i // s * s
+            boxj = j // s * s
+
+            # box
+            for x in range(boxi, boxi + s, 1):
+                for y in range(boxj, boxj + s, 1):
+                    if x != i and y != j:
+                        neighbors.add(coordToIndex(x, y, n))
+
+            # column
+            for y in range(0, n, 1):
+                if y != j:
+                    neighbors.add(coordToIndex(i, y, n))
+
+            # row
+            for x in range(0, n, 1):
+                if x != i:
+                    neighbors.add(coordToIndex(x, j, n))
+
+            neighbormap[coordToIndex(i, j, n)] = neighbors
+
+    return neighbormap
+
+def coordToIndex(x, y, n):
+    return x + y*n
+
+def domainmap(board):
+    n = len(board)
+
+    allnums = set(range(1, n + 1, 1))
+    domain = {}
+
+    for x in range(0, n, 1):
+        for y in range(0, n, 1):
+            # domain is all numbers
+            if board[y][x] == 0:
+                domain[coordToIndex(x, y, n)] = allnums.copy()
+            # domain is one number
+            else:
+                domain[coordToIndex(x, y, n)] = { board[y][x] }
+
+    return domain
+
+# one all-different constraint per row, column and box (3n in total),
+# rather than a not-equal constraint for every pair of neighbors
+def constraintmap(n):
+    constraints = {}
+
+    s = int(math.sqrt(n))
+
+    for i in range(0, n, 1):
+        row = tuple(coordToIndex(x, i, n) for x in range(0, n, 1))
+        column = tuple(coordToIndex(i, y, n) for y in range(0, n, 1))
+
+        boxi = i % s * s
+        boxj = i // s * s
+        box = tuple(sorted(coordToIndex(x, y, n) for x in range(boxi, boxi + s, 1)
+                                                 for y in range(boxj, boxj + s, 1)))
+
+        constraints[row] = AllDifferent()
+        constraints[column] = AllDifferent()
+        constraints[box] = AllDifferent()
+
+    return constraints
+
+# raises ValueError unless board (a list of rows) is n x n, with n a perfect square
+# (and the n given, if any), and every digit is from 0 (blank) to n
+def checkBoard(board, n = None):
+    size = len(board)
+
+    if size == 0 or math.isqrt(size) ** 2 != size or any(len(row) != size for row in board):
+        raise ValueError("board must be n x n, with n a perfect square")
+    if n is not None and size != n:
+        raise ValueError("expected a " + str(n) + "x" + str(n) + " board")
+    if any(not isinstance(digit, int) or not 0 <= digit <= size for row in board for digit in row):
+        raise ValueError("the digits of a " + str(size) + "x" + str(size) + " board go from 0 (blank) to " + str(size))
+
+# a one-line puzzle, row by row: 1-9 then A, B, ... for 10 onwards, and 0 or . for blanks.
+# raises ValueError if it is not a valid board (see checkBoard)
+def parseBoard(line):
+    line = line.strip()
+    n = math.isqrt(len(line))
+    if n * n != len(line):
+        raise ValueError("a board of " + str(len(line)) + " characters is not n x n")
+
+    values = [0 if c in "0." else int(c, 36) for c in line]
+    board = [values[y*n:(y + 1)*n] for y in range(0, n, 1)]
+    checkBoard(board)
+
+    return board
+
+# the puzzles in a file with one puzzle per line (blank lines and # comments skipped)
+def readPuzzles(path):
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+# solves many n x n boards, with the neighbors and constraints built and compiled
+# once. boards are lists of rows (0 for blanks) or one-line puzzles, and each
+# solution comes back as a list of rows, or None if the board has none. e.g.
+#   for solution in SudokuBatch(9).solve_all(readPuzzles("puzzles.txt"), workers = 4):
+class SudokuBatch(BatchSolver):
+    def __init__(self, n, MRV = True, DH = False, LCV = True, AC3 = True, **options):
+        self.n = n
+
+        BatchSolver.__init__(self, genNeighbors(n), domainmap([[0] * n] * n), constraintmap(n), MRV, DH, LCV, AC3, **options)
+
+    def instance(self, board):
+        if isinstance(board, str):
+            board = parseBoard(board)
+
+        checkBoard(board, self.n)
+
+        return domainmap(board)
+
+    def answer(self, assignment):
+        n = self.n
+        return [assignment[y*n:(y + 1)*n] for y in range(0, n, 1)]
+
 
 def test1():
     board = [[3, 2, 0, 0, 0, 0, 0, 0, 7],
@@ -177,4 +244,5 @@ def test2():
     print("solving...")
     print(p)
 # test1()
-test2()
+if __name__ == "__main__":
+    test2()
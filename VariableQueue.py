@@ -0,0 +1,44 @@
+import heapq
+
+# the unassigned variables, ordered by a key (lowest first) for the weighted
+# variable orderings of ConstraintSatisfactionProblem. it is a binary heap with
+# lazy deletion: pushing a variable again just adds a newer entry, and entries
+# which no longer match a variable's current key are skipped when popping. so
+# both push and pop are O(log n) instead of a scan over every variable.
+class VariableQueue:
+        # key: function (variable -> key), ties go to the lowest variable
+    def __init__(self, key, variables = ()):
+        self.key = key
+        self.keys = {} # variable -> key of its live entry
+        self.heap = [] # (key, variable), live and stale
+
+        for variable in variables:
+            self.push(variable)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, variable):
+        return variable in self.keys
+
+        # adds a variable, or files it again under its current key
+    def push(self, variable):
+        key = self.key(variable)
+        self.keys[variable] = key
+        heapq.heappush(self.heap, (key, variable))
+
+        # stale entries are left in the heap, so rebuild it once they dominate
+        if len(self.heap) > 4 * len(self.keys) + 64:
+            self.heap = [(key, variable) for variable, key in self.keys.items()]
+            heapq.heapify(self.heap)
+
+        # removes and returns the variable with the lowest key, None if it is empty
+    def pop(self):
+        while self.heap:
+            key, variable = heapq.heappop(self.heap)
+
+            if self.keys.get(variable) == key:
+                del self.keys[variable]
+                return variable
+
+        return None